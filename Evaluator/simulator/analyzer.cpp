@@ -1,9 +1,25 @@
 #include "utils.h"
+#include "binary_io.h"
 
 vector<Node*> nodes;
 vector<Task*> tasks;
 
+void add_nodes(int node_cpu, int node_mem, int num){
+    for(int i = 0; i < num; i++){
+        Node *node = new Node(nodes.size(), {node_cpu, node_mem});
+        nodes.push_back(node);
+    }
+}
+
 void read_node(){
+    if(file_exists("nodes_info.bin")){
+        BinaryTable table("nodes_info.bin");
+        vector<int> col = table.columns({"node_cpu", "node_mem", "num"});
+        for(uint64_t i = 0; i < table.rows; i++){
+            add_nodes(table.at(i, col[0]), table.at(i, col[1]), table.at(i, col[2]));
+        }
+        return;
+    }
     ifstream fin;
     fin.open("nodes_info.txt");
     if(!fin.is_open()){
@@ -14,32 +30,43 @@ void read_node(){
     string node_name;
     int num;
     while(fin >> node_cpu >> node_mem >> num){
-        for(int i = 0; i < num; i++){
-            Node *node = new Node(nodes.size(), {node_cpu, node_mem});
-            nodes.push_back(node);
-        }
+        add_nodes(node_cpu, node_mem, num);
     }
     fin.close();
 }
 
 void analysis_simulation_result(vector<Task*> tasks, int l, int r, string name = ""){
     tasks.clear();
-    string file_name = name + "_simulation_result.txt";
-    ifstream fin;
-    fin.open(file_name);
-    if (!fin.is_open()) {
-        cerr << file_name << " not found" << endl;
-        return ;
-    }
-    while(!fin.eof()){
-        int submit_time, ended, start_time, execution_time, node_num, cpu_req;
-        fin >> submit_time >> ended >> start_time >> execution_time >> node_num >> cpu_req;
-        if(fin.eof()) break;
+    auto add_result = [&](int submit_time, int ended, int start_time, int execution_time, int node_num, int cpu_req){
         tasks.push_back(new Task(tasks.size(), submit_time, 0, 0, node_num, {cpu_req, 0}, execution_time));
         tasks.back()->ended = ended;
         tasks.back()->start_time = start_time;
+    };
+    string binary_name = name + "_simulation_result.bin";
+    if(file_exists(binary_name)){
+        BinaryTable table(binary_name);
+        vector<int> col = table.columns({"submit_time", "ended", "start_time", "execution_time", "node_num", "cpu_req"});
+        tasks.reserve(table.rows);
+        for(uint64_t i = 0; i < table.rows; i++){
+            add_result(table.at(i, col[0]), table.at(i, col[1]), table.at(i, col[2]), table.at(i, col[3]), table.at(i, col[4]), table.at(i, col[5]));
+        }
+    }
+    else{
+        string file_name = name + "_simulation_result.txt";
+        ifstream fin;
+        fin.open(file_name);
+        if (!fin.is_open()) {
+            cerr << file_name << " not found" << endl;
+            return ;
+        }
+        while(!fin.eof()){
+            int submit_time, ended, start_time, execution_time, node_num, cpu_req;
+            fin >> submit_time >> ended >> start_time >> execution_time >> node_num >> cpu_req;
+            if(fin.eof()) break;
+            add_result(submit_time, ended, start_time, execution_time, node_num, cpu_req);
+        }
+        fin.close();
     }
-    fin.close();
 
     int test_task_num = 0;
     double avg_pending_time = 0;
@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'train'))
+from features import load_jobs, jobs_history, predict_features, model_input
+from tree_model import ENGINES, NUMPY_MAX_ROWS, choose_engine, load_predictor
+from prediction_cache import PredictionCache
+from data_loader import jobs_info, open_jobs_info, append_jobs_info, copy_nodes_info
+
+MANIFEST_COLUMNS = ['cluster', 'model', 'start_time', 'end_time']
+
+# per worker process: cluster -> (jobs, history) and (model path, engine) -> TreeModel, Booster or PredictionCache
+_clusters = {}
+_models = {}
+_data_root = '../data'
+_binary = False
+_prediction_cache = False
+_engine = 'auto'
+
+def _init_worker(data_root, binary, prediction_cache, engine='auto'):
+    global _data_root, _binary, _prediction_cache, _engine
+    _data_root, _binary, _prediction_cache, _engine = data_root, binary, prediction_cache, engine
+
+def _cluster(cluster):
+    # every job of the cluster with its history, the features of any window are slices of it
+    if cluster not in _clusters:
+        jobs = load_jobs(os.path.join(_data_root, cluster, 'jobs_table.csv'))
+        _clusters[cluster] = (jobs, jobs_history(jobs))
+    return _clusters[cluster]
+
+def _model(model_folder, rows):
+    model_path = os.path.join(model_folder, 'model.txt')
+    if _prediction_cache:
+        key = (model_path, _engine)
+        if key not in _models:
+            _models[key] = PredictionCache(model_path, engine=_engine)
+        return _models[key]
+    key = (model_path, choose_engine(rows, _engine))
+    if key not in _models:
+        _models[key] = load_predictor(model_path, engine=key[1])
+    return _models[key]
+
+def _timestamp(value):
+    return (pd.to_datetime(value) - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
+
+def output_folder(output_root, task):
+    # <output_root>/<cluster>_<model folder>_<start>_<end>
+    name = '_'.join([task['cluster'], os.path.basename(os.path.normpath(task['model'])), str(task['start_time']), str(task['end_time'])])
+    return os.path.join(output_root, name.replace(' ', 'T').replace(':', ''))
+
+def run_task(task):
+    start = time.time()
+    result = {'cluster': task['cluster'], 'model': task['model'], 'start_time': task['start_time'], 'end_time': task['end_time'],
+              'output': task['output'], 'jobs': 0, 'cache_hits': 0, 'cache_misses': 0, 'error': ''}
+    try:
+        jobs, history = _cluster(task['cluster'])
+        df = predict_features(jobs, _timestamp(task['end_time']), history=history)
+        df = df[df['time_submit'] >= _timestamp(task['start_time'])].copy()
+        model = _model(task['model'], len(df))
+        if isinstance(model, PredictionCache):
+            hits, misses = model.hits, model.misses
+            df['time_pred'] = model.predict(model_input(df))
+            model.save()
+            result['cache_hits'], result['cache_misses'] = model.hits - hits, model.misses - misses
+        else:
+            df['time_pred'] = model.predict(model_input(df))
+
+        if not os.path.exists(task['output']):
+            os.makedirs(task['output'])
+        copy_nodes_info(os.path.join(_data_root, task['cluster'], 'nodes_info.txt'), task['output'], _binary)
+        info = jobs_info(df)
+        with open_jobs_info(task['output'], _binary) as f:
+            append_jobs_info(info, f)
+        result['jobs'] = len(info)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['wall_time'] = round(time.time() - start, 3)
+    return result
+
+def read_manifest(path, output_root):
+    # CSV with cluster,model,start_time,end_time and an optional output column
+    manifest = pd.read_csv(path, dtype=str, skipinitialspace=True)
+    missing = [col for col in MANIFEST_COLUMNS if col not in manifest.columns]
+    if missing:
+        raise ValueError(f'{path}: missing columns {missing}')
+    tasks = manifest.to_dict('records')
+    for task in tasks:
+        if 'output' not in task or pd.isna(task['output']):
+            task['output'] = output_folder(output_root, task)
+    outputs = [task['output'] for task in tasks]
+    duplicated = sorted({output for output in outputs if outputs.count(output) > 1})
+    if duplicated:
+        raise ValueError(f'{path}: several tasks write to {duplicated}')
+    return tasks
+
+def run_batch(tasks, data_root='../data', workers=None, binary=False, prediction_cache=False, engine='auto'):
+    # Tasks of the same cluster and model are handed out next to each other, so that a worker loads
+    # a cluster table or a model once for a run of tasks instead of once per task
+    tasks = sorted(tasks, key=lambda task: (task['cluster'], task['model']))
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tasks)))
+    chunksize = max(1, len(tasks) // (4 * workers))
+
+    results = []
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(data_root, binary, prediction_cache, engine)) as pool:
+        for result in pool.imap_unordered(run_task, tasks, chunksize):
+            status = result['error'] or f'{result["jobs"]} jobs'
+            print(f'{result["cluster"]} {result["model"]} [{result["start_time"]}, {result["end_time"]}): {status}, {result["wall_time"]:.1f}s')
+            results.append(result)
+    return pd.DataFrame(results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write simulator inputs for every (cluster, model, window) of a manifest')
+    parser.add_argument('manifest', help='CSV with cluster,model,start_time,end_time[,output] columns')
+    parser.add_argument('output_root', nargs='?', default='./batch', help='parent of the per-task output folders (default: ./batch)')
+    parser.add_argument('--data-root', default='../data', help='folder of the <cluster>/jobs_table.csv and nodes_info.txt files')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--binary', action='store_true', help='write jobs_info.bin / nodes_info.bin instead of the text files')
+    parser.add_argument('--prediction-cache', action='store_true', help='reuse predictions across tasks and runs, kept in <model>/predictions.npz')
+    parser.add_argument('--engine', choices=ENGINES, default='auto', help=f'model.txt evaluator, auto: numpy up to {NUMPY_MAX_ROWS} jobs per window, lightgbm above')
+    args = parser.parse_args()
+
+    tasks = read_manifest(args.manifest, args.output_root)
+    results = run_batch(tasks, args.data_root, args.workers, args.binary, args.prediction_cache, args.engine)
+
+    if not os.path.exists(args.output_root):
+        os.makedirs(args.output_root)
+    results.to_csv(os.path.join(args.output_root, 'batch_results.csv'), index=False)
+    if args.prediction_cache:
+        hits, misses = results['cache_hits'].sum(), results['cache_misses'].sum()
+        print(f'prediction cache: {hits} hits, {misses} misses')
+    failed = results[results['error'] != '']
+    if len(failed) > 0:
+        print(f'{len(failed)} of {len(results)} tasks failed')
+        sys.exit(1)
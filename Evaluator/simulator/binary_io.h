@@ -0,0 +1,127 @@
+#pragma once
+
+#include<bits/stdc++.h>
+#include<fcntl.h>
+#include<sys/mman.h>
+#include<sys/stat.h>
+#include<unistd.h>
+
+using namespace std;
+
+// Binary simulator tables written by jobs_format.py. Little-endian header:
+//   magic "SIMT", uint32 version, uint32 ncols, uint64 rows, ncols NUL padded 16-byte column names
+// followed by rows fixed-width records of ncols int32.
+const char BINARY_MAGIC[4] = {'S', 'I', 'M', 'T'};
+const uint32_t BINARY_VERSION = 1;
+const int BINARY_NAME_BYTES = 16;
+const size_t BINARY_HEADER_BYTES = 20;
+
+inline bool file_exists(const string &path){
+    struct stat st;
+    return stat(path.c_str(), &st) == 0;
+}
+
+template<typename T>
+inline T from_le(T value){
+#if __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+    if(sizeof(T) == 4) return __builtin_bswap32(value);
+    if(sizeof(T) == 8) return __builtin_bswap64(value);
+#endif
+    return value;
+}
+
+struct BinaryTable{
+    string path;
+    const char *data = nullptr;
+    size_t size = 0;
+    uint32_t ncols = 0;
+    uint64_t rows = 0;
+    vector<string> names;
+    const int32_t *records = nullptr;
+
+    // memory-maps path, exits on a file that is not a valid table
+    explicit BinaryTable(const string &path): path(path){
+        int fd = open(path.c_str(), O_RDONLY);
+        if(fd < 0) fail("cannot open");
+        struct stat st;
+        fstat(fd, &st);
+        size = st.st_size;
+        if(size < BINARY_HEADER_BYTES) fail("truncated header");
+        data = (const char*)mmap(nullptr, size, PROT_READ, MAP_PRIVATE, fd, 0);
+        close(fd);
+        if(data == MAP_FAILED) fail("mmap failed");
+
+        uint32_t version;
+        if(memcmp(data, BINARY_MAGIC, 4) != 0) fail("not a binary simulator table");
+        memcpy(&version, data + 4, 4);
+        memcpy(&ncols, data + 8, 4);
+        memcpy(&rows, data + 12, 8);
+        version = from_le(version), ncols = from_le(ncols), rows = from_le(rows);
+        if(version != BINARY_VERSION) fail("unsupported version " + to_string(version));
+
+        size_t offset = BINARY_HEADER_BYTES + (size_t)ncols * BINARY_NAME_BYTES;
+        if(size != offset + rows * ncols * 4) fail("expected " + to_string(rows) + " records of " + to_string(ncols) + " columns");
+        for(uint32_t i = 0; i < ncols; i++){
+            const char *name = data + BINARY_HEADER_BYTES + i * BINARY_NAME_BYTES;
+            names.push_back(string(name, strnlen(name, BINARY_NAME_BYTES)));
+        }
+        records = (const int32_t*)(data + offset);
+    }
+
+    ~BinaryTable(){
+        if(data != nullptr && data != MAP_FAILED) munmap((void*)data, size);
+    }
+
+    void fail(const string &message) const {
+        cerr << path << ": " << message << endl;
+        exit(1);
+    }
+
+    int column(const string &name) const {
+        for(uint32_t i = 0; i < ncols; i++){
+            if(names[i] == name) return i;
+        }
+        fail("missing column " + name);
+        return -1;
+    }
+
+    // indices of columns, in the order given
+    vector<int> columns(const vector<string> &wanted) const {
+        vector<int> index;
+        for(auto &name: wanted) index.push_back(column(name));
+        return index;
+    }
+
+    int32_t at(uint64_t row, int col) const {
+        return from_le(records[row * ncols + col]);
+    }
+};
+
+// rows of int32 values, row-major
+inline void write_binary_table(const string &path, const vector<string> &names, const vector<int32_t> &values){
+    uint32_t ncols = names.size();
+    uint64_t rows = ncols == 0 ? 0 : values.size() / ncols;
+    ofstream fout(path, ios::binary);
+    assert(fout.is_open());
+
+    uint32_t version = from_le(BINARY_VERSION), le_ncols = from_le(ncols);
+    uint64_t le_rows = from_le(rows);
+    fout.write(BINARY_MAGIC, 4);
+    fout.write((const char*)&version, 4);
+    fout.write((const char*)&le_ncols, 4);
+    fout.write((const char*)&le_rows, 8);
+    for(auto &name: names){
+        char buffer[BINARY_NAME_BYTES] = {0};
+        memcpy(buffer, name.data(), min((size_t)BINARY_NAME_BYTES, name.size()));
+        fout.write(buffer, BINARY_NAME_BYTES);
+    }
+#if __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+    for(auto value: values){
+        int32_t le_value = from_le(value);
+        fout.write((const char*)&le_value, 4);
+    }
+#else
+    fout.write((const char*)values.data(), values.size() * 4);
+#endif
+    fout.close();
+}
@@ -1,122 +1,152 @@
+import os
 import sys
+import argparse
+import numpy as np
 import pandas as pd
-import lightgbm as lgb
 import shutil
-import heapq
-
-def feature_extract(job_table_path, test_end_time):
-    with open(job_table_path, 'r', errors='ignore') as f:
-        data = pd.read_csv(f)
-
-    data = data.loc[data['time_submit'] < test_end_time]
-
-    data['timelimit'] = data['timelimit'] * 60
-    data['running_time'] = data['time_end'] - data['time_start']
-    data = data[data['running_time'] <= data['timelimit'] + 60]
-    
-    data['time_submit_standard'] = pd.to_datetime(data['time_submit'], unit='s')
-
-    data['sub_year'] = data['time_submit_standard'].dt.year.astype(int)
-    data['sub_quarter'] = data['time_submit_standard'].dt.quarter.astype(int)
-    data['sub_month'] = data['time_submit_standard'].dt.month.astype(int)
-    data['sub_day'] = data['time_submit_standard'].dt.day.astype(int)
-    data['sub_hour'] = data['time_submit_standard'].dt.hour.astype(int)
-    # data['sub_minute'] = data['time_submit_standard'].dt.minute.astype(int)
-    # data['sub_second'] = data['time_submit_standard'].dt.second.astype(int)
-    data['sub_day_of_year'] = data['time_submit_standard'].dt.dayofyear.astype(int)
-    data['sub_day_of_month'] = data['time_submit_standard'].dt.day.astype(int)
-    data['sub_day_of_week'] = data['time_submit_standard'].dt.dayofweek.astype(int)
-
-    data = data.drop('time_submit_standard', axis=1)
-    data = data.sort_values(by='time_submit').reset_index(drop=True)
-
-    data['top1_time'] = 0
-    data['top2_time'] = 0
-
-    pq_running = [] # (time_end, idx), sorted by time_end
-    pq_finished = {} # group by user, (idx, running_time), sorted by idx
-    for idx, item in data.iterrows():
-        time_submit = item['time_submit']
-        while len(pq_running) > 0 and pq_running[0][0] < time_submit:
-            _, idx_ = heapq.heappop(pq_running)
-            user = data.loc[idx_]['id_user']
-            running_time = data.loc[idx_]['running_time']
-            if user not in pq_finished:
-                pq_finished[user] = []
-            heapq.heappush(pq_finished[user], (idx_, running_time))
-            if(len(pq_finished[user]) > 2):
-                heapq.heappop(pq_finished[user])
-                
-        user = item['id_user']
-        if user not in pq_finished:
-            data.at[idx, 'top1_time'] = 0
-            data.at[idx, 'top2_time'] = 0
-        elif len(pq_finished[user]) == 1:
-            data.at[idx, 'top1_time'] = pq_finished[user][0][1]
-            data.at[idx, 'top2_time'] = pq_finished[user][0][1]
-        else:
-            data.at[idx, 'top1_time'] = pq_finished[user][1][1]
-            data.at[idx, 'top2_time'] = pq_finished[user][0][1]
-        
-        if item['state'] == 3:
-            heapq.heappush(pq_running, (item['time_end'], idx))
-
-    data['top2_mean'] = data[['top1_time', 'top2_time']].mean(axis=1)
 
-    data = data.drop("time_start", axis=1)
-    data = data.drop("time_end", axis=1)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'train'))
+import history
+import profiling
+from features import feature_extract_predict, model_input
+from history import load_history_state
+from profiling import memory_report, stage, save_timing
+from tree_model import ENGINES, NUMPY_MAX_ROWS, load_predictor
+from prediction_cache import PredictionCache
+from jobs_format import JOBS_COLUMNS, BinaryWriter, binary_path, text_to_binary
+
+RUNNING_INFOS = ['time_submit', 'priority', 'timelimit', 'time_pred', 'running_time', 'nodes_alloc', 'cpus_req']
+NONZERO_COLUMNS = ['priority', 'timelimit', 'running_time', 'nodes_alloc', 'cpus_req']
+
+def predict(df, model_path, cache=None, engine='auto'):
+    X_test = model_input(df)
+    memory_report('predict matrix', X_test)
+
+    with stage('predict'):
+        if cache is not None:
+            y_pred = cache.predict(X_test)
+        else:
+            # small windows skip the lightgbm import, their parsed trees are cached next to model.txt
+            model = load_predictor(model_path, len(X_test), engine)
+            y_pred = model.predict(X_test)
 
-    return data
+    df['time_pred'] = y_pred
+    return df
+
+def jobs_info(df):
+    # Simulator rows: predictions rounded and clamped to [1, timelimit], running times clamped to
+    # timelimit, jobs with a zero field dropped. df is sorted by time_submit already.
+    timelimit = df['timelimit'].to_numpy()
+    time_pred = df['time_pred'].to_numpy()
+    time_pred = np.where(time_pred <= 1, 1, np.minimum(time_pred, timelimit))
+
+    info = pd.DataFrame({col: df[col].to_numpy() for col in RUNNING_INFOS})
+    info['time_pred'] = np.rint(time_pred).astype(np.int64)
+    info['running_time'] = np.minimum(info['running_time'].to_numpy(), timelimit)
+
+    mask = np.ones(len(info), dtype=bool)
+    for col in NONZERO_COLUMNS:
+        mask &= info[col].to_numpy() != 0
+    return info.loc[mask].sort_values(by='time_submit', kind='stable')
+
+def _replace(path, stale_path):
+    # the simulator reads the binary file when it exists, never leave one of another run behind
+    if os.path.exists(stale_path):
+        os.remove(stale_path)
+    return path
+
+def open_jobs_info(output_path, binary=False):
+    path = output_path + '/jobs_info.txt'
+    if binary:
+        return BinaryWriter(_replace(binary_path(path), path), JOBS_COLUMNS)
+    return open(_replace(path, binary_path(path)), 'w')
+
+def append_jobs_info(info, f):
+    if isinstance(f, BinaryWriter):
+        f.append(info)
+    else:
+        info.to_csv(f, index=False, sep=' ', header=False)
+
+def copy_nodes_info(node_info_path, output_path, binary=False):
+    path = output_path + '/nodes_info.txt'
+    if binary:
+        text_to_binary(node_info_path, _replace(binary_path(path), path))
+    else:
+        shutil.copyfile(node_info_path, _replace(path, binary_path(path)))
+
+def write_jobs_info(df, output_path, binary=False):
+    with stage('postprocess'):
+        info = jobs_info(df)
+
+    with stage('write'):
+        with open_jobs_info(output_path, binary) as f:
+            append_jobs_info(info, f)
+
+def predict_chunks(df, model_path, output_path, chunk_size, binary=False, cache=None, engine='auto'):
+    # predict and append jobs_info.txt chunk_size rows at a time, the prediction matrix, the tree
+    # walks and the output rows never exceed one chunk. The rows stay in time_submit order.
+    model = cache if cache is not None else load_predictor(model_path, len(df), engine)
+    with stage('predict_chunks'):
+        with open_jobs_info(output_path, binary) as f:
+            for start in range(0, len(df), chunk_size):
+                chunk = df.iloc[start:start + chunk_size].copy()
+                chunk['time_pred'] = model.predict(model_input(chunk))
+                append_jobs_info(jobs_info(chunk), f)
+    memory_report('predict chunks')
 
 if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        print('Usage: python predict.py cluster_name model_path start_time end_time')
-        sys.exit(1)
-    
-    job_table_path = '../data/' + sys.argv[1] + '/jobs_table.csv'
-    node_info_path = '../data/' + sys.argv[1] + '/nodes_info.txt'
-    mode_path = sys.argv[2] + '/model.txt'
+    parser = argparse.ArgumentParser(description='Predict running times of the jobs submitted in [start_time, end_time)')
+    parser.add_argument('cluster_name')
+    parser.add_argument('model_path')
+    parser.add_argument('start_time')
+    parser.add_argument('end_time')
+    parser.add_argument('state_path', nargs='?', help='history state, resumed from when present and advanced to end_time')
+    parser.add_argument('--memory-report', action='store_true', help='print per-column bytes and peak RSS of each stage')
+    parser.add_argument('--profile', action='store_true', help='record wall time, CPU time and peak RSS of each stage in model_path/profile_predict.json')
+    parser.add_argument('--binary', action='store_true', help='write jobs_info.bin / nodes_info.bin instead of the text files')
+    parser.add_argument('--chunk-size', type=int, help='predict and write jobs_info.txt this many jobs at a time')
+    parser.add_argument('--prediction-cache', action='store_true', help='reuse predictions of earlier runs with the same model.txt, kept in model_path/predictions.npz')
+    parser.add_argument('--engine', choices=ENGINES, default='auto', help=f'model.txt evaluator, auto: numpy up to {NUMPY_MAX_ROWS} jobs, lightgbm above')
+    parser.add_argument('--history-workers', type=int, default=1, help='processes for the user-sharded history features (default: 1)')
+    args = parser.parse_args()
+
+    if args.memory_report:
+        profiling.enable()
+    if args.profile:
+        profiling.enable_timing()
+    history.set_workers(args.history_workers)
+
+    job_table_path = '../data/' + args.cluster_name + '/jobs_table.csv'
+    node_info_path = '../data/' + args.cluster_name + '/nodes_info.txt'
+    mode_path = args.model_path + '/model.txt'
     output_path = './'
 
-    start_time = (pd.to_datetime(sys.argv[3]) - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
-    end_time = (pd.to_datetime(sys.argv[4]) - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
-
-    shutil.copyfile(node_info_path, output_path + '/nodes_info.txt')
-
-    df = feature_extract(job_table_path, end_time)
-
-    df = df[df['time_submit'] >= start_time]
-
-    features = ['id_user', 'id_qos', 'cpus_req', 'nodes_alloc', 'timelimit', 'time_submit', 'sub_year', 'sub_quarter', 'sub_month', 'sub_day', 'sub_hour', 'sub_day_of_year', 'sub_day_of_month', 'sub_day_of_week', 'top1_time', 'top2_time', 'top2_mean']
-    X_test = df[features]
-
-    gbm = lgb.Booster(model_file=mode_path)
-    y_pred = gbm.predict(X_test)
-
-    df['time_pred'] = y_pred
-
-    for idx, item in df.iterrows():
-        if item['time_pred'] > item['timelimit']:
-            df.at[idx, 'time_pred'] = item['timelimit']
-        if item['time_pred'] <= 1:
-            df.at[idx, 'time_pred'] = 1
-        if item['running_time'] > item['timelimit']:
-            df.at[idx, 'running_time'] = item['timelimit']
-        item['time_pred'] = round(item['time_pred'])
-    df['time_pred'] = df['time_pred'].astype(int)
+    start_time = (pd.to_datetime(args.start_time) - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
+    end_time = (pd.to_datetime(args.end_time) - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
 
-    running_infos = ['time_submit', 'priority', 'timelimit', 'time_pred', 'running_time', 'nodes_alloc', 'cpus_req']
-    df = df[running_infos]
+    copy_nodes_info(node_info_path, output_path, args.binary)
 
-    df = df[df['priority'] != 0]
-    df = df[df['timelimit'] != 0]
-    df = df[df['running_time'] != 0]
-    df = df[df['nodes_alloc'] != 0]
-    df = df[df['cpus_req'] != 0]
+    # an existing state is resumed from and then advanced to end_time, for consecutive windows
+    state_path = args.state_path
+    resume_path = state_path if state_path is not None and os.path.exists(state_path) else None
+    if resume_path is not None and load_history_state(resume_path, 'predict')['cutoff'] > start_time:
+        print(f'History state {resume_path} is past start_time')
+        sys.exit(1)
 
-    df.sort_values(by='time_submit', inplace=True)
+    df = feature_extract_predict(job_table_path, end_time, resume_path, state_path)
 
-    df.to_csv(output_path + '/jobs_info.txt', index=False, sep=' ', header=False)
-    
-        
+    df = df[df['time_submit'] >= start_time]
 
+    cache = PredictionCache(mode_path, engine=args.engine) if args.prediction_cache else None
+    if args.chunk_size is not None:
+        predict_chunks(df, mode_path, output_path, args.chunk_size, args.binary, cache, args.engine)
+    else:
+        df = predict(df, mode_path, cache, args.engine)
+        write_jobs_info(df, output_path, args.binary)
+
+    info = {'command': sys.argv}
+    if cache is not None:
+        cache.save()
+        print(cache.summary())
+        info['prediction_cache'] = cache.stats()
+    save_timing(os.path.join(args.model_path, 'profile_predict.json'), **info)
@@ -0,0 +1,33 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'train'))
+from features import feature_extract
+from train import train_model
+from data_loader import predict, write_jobs_info, copy_nodes_info
+
+if __name__ == '__main__':
+    if len(sys.argv) != 6:
+        print('Usage: python experiment.py cluster_name split_time start_time end_time model_folder')
+        sys.exit(1)
+
+    job_table_path = '../data/' + sys.argv[1] + '/jobs_table.csv'
+    node_info_path = '../data/' + sys.argv[1] + '/nodes_info.txt'
+    saving_folder = os.path.join(sys.argv[5], '')
+    output_path = './'
+
+    split_time = (pd.to_datetime(sys.argv[2]) - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
+    start_time = (pd.to_datetime(sys.argv[3]) - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
+    end_time = (pd.to_datetime(sys.argv[4]) - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
+
+    copy_nodes_info(node_info_path, output_path)
+
+    # training and prediction sets come from the same scan of the job table
+    df_train, df = feature_extract(job_table_path, split_time, end_time)
+    train_model(df_train, saving_folder)
+
+    df = df[df['time_submit'] >= start_time]
+
+    df = predict(df, saving_folder + 'model.txt')
+    write_jobs_info(df, output_path)
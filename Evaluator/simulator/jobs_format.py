@@ -0,0 +1,139 @@
+import os
+import struct
+import argparse
+import numpy as np
+import pandas as pd
+
+# Binary simulator tables, read by binary_io.h. Little-endian header:
+#   magic 'SIMT', uint32 version, uint32 ncols, uint64 rows, ncols NUL padded 16-byte column names
+# followed by rows fixed-width records of ncols int32.
+MAGIC = b'SIMT'
+VERSION = 1
+NAME_BYTES = 16
+HEADER = struct.Struct('<4sIIQ')
+
+JOBS_COLUMNS = ['time_submit', 'priority', 'timelimit', 'time_pred', 'running_time', 'nodes_alloc', 'cpus_req']
+NODES_COLUMNS = ['node_cpu', 'node_mem', 'num']
+RESULT_COLUMNS = ['submit_time', 'ended', 'start_time', 'execution_time', 'node_num', 'cpu_req']
+
+def schema_of(path):
+    # column names of a simulator file, from its name
+    name = os.path.basename(path)
+    if name.startswith('jobs_info'):
+        return JOBS_COLUMNS
+    if name.startswith('nodes_info'):
+        return NODES_COLUMNS
+    if '_simulation_result' in name:
+        return RESULT_COLUMNS
+    raise ValueError(f'{path}: unknown simulator file, expected jobs_info, nodes_info or *_simulation_result')
+
+def binary_path(path):
+    # jobs_info.txt -> jobs_info.bin
+    return os.path.splitext(path)[0] + '.bin'
+
+def text_path(path):
+    return os.path.splitext(path)[0] + '.txt'
+
+def _header(columns, rows):
+    for col in columns:
+        if len(col.encode()) > NAME_BYTES:
+            raise ValueError(f'column name {col} is longer than {NAME_BYTES} bytes')
+    return HEADER.pack(MAGIC, VERSION, len(columns), rows) + b''.join(col.encode().ljust(NAME_BYTES, b'\0') for col in columns)
+
+def _records(values, columns):
+    values = np.asarray(values)
+    if values.ndim != 2 or values.shape[1] != len(columns):
+        raise ValueError(f'expected {len(columns)} columns, got shape {values.shape}')
+    if len(values) > 0 and (values.min() < np.iinfo(np.int32).min or values.max() > np.iinfo(np.int32).max):
+        raise ValueError('values do not fit in int32')
+    return np.ascontiguousarray(values, dtype='<i4')
+
+class BinaryWriter:
+    # Appends int32 records to a binary table. The row count in the header is written by close(), the
+    # file is renamed into place then, so a partial table is never read.
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self.rows = 0
+        self.f = open(path + '.tmp', 'wb')
+        self.f.write(_header(self.columns, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+            os.remove(self.path + '.tmp')
+
+    def append(self, values):
+        if isinstance(values, pd.DataFrame):
+            values = values[self.columns].to_numpy()
+        records = _records(values, self.columns)
+        records.tofile(self.f)
+        self.rows += len(records)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(_header(self.columns, self.rows))
+        self.f.close()
+        os.replace(self.path + '.tmp', self.path)
+
+def write_table(path, values, columns):
+    writer = BinaryWriter(path, columns)
+    writer.append(values)
+    writer.close()
+
+def read_table(path):
+    # the records as a DataFrame of int32 columns, memory-mapped
+    with open(path, 'rb') as f:
+        head = f.read(HEADER.size)
+        if len(head) < HEADER.size:
+            raise ValueError(f'{path}: truncated header')
+        magic, version, ncols, rows = HEADER.unpack(head)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: not a binary simulator table')
+        if version != VERSION:
+            raise ValueError(f'{path}: unsupported version {version}, expected {VERSION}')
+        names = f.read(ncols * NAME_BYTES)
+        if len(names) < ncols * NAME_BYTES:
+            raise ValueError(f'{path}: truncated header')
+        columns = [names[i:i + NAME_BYTES].rstrip(b'\0').decode() for i in range(0, len(names), NAME_BYTES)]
+    offset = HEADER.size + ncols * NAME_BYTES
+    if os.path.getsize(path) != offset + rows * ncols * 4:
+        raise ValueError(f'{path}: expected {rows} records of {ncols} columns')
+    if rows == 0:
+        return pd.DataFrame({col: np.zeros(0, dtype='<i4') for col in columns})
+    records = np.memmap(path, dtype='<i4', mode='r', offset=offset, shape=(rows, ncols)).view(np.ndarray)
+    return pd.DataFrame(records, columns=columns, copy=False)
+
+def read_text(path, columns):
+    data = pd.read_csv(path, sep=r'\s+', header=None, dtype=np.int64, engine='c')
+    if data.shape[1] != len(columns):
+        raise ValueError(f'{path}: expected {len(columns)} columns, got {data.shape[1]}')
+    data.columns = columns
+    return data
+
+def text_to_binary(path, output=None):
+    columns = schema_of(path)
+    output = output or binary_path(path)
+    write_table(output, read_text(path, columns).to_numpy(), columns)
+    return output
+
+def binary_to_text(path, output=None):
+    output = output or text_path(path)
+    read_table(path).to_csv(output, index=False, sep=' ', header=False)
+    return output
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert simulator text files (jobs_info, nodes_info, *_simulation_result) to the binary format')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--to-text', action='store_true', help='convert binary files back to text')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        output = binary_to_text(path) if args.to_text else text_to_binary(path)
+        print(f'{path} -> {output}')
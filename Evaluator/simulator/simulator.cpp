@@ -1,4 +1,5 @@
 #include "scheduler.h"
+#include "binary_io.h"
 
 scheduler::scheduler_type type = scheduler::scheduler_type::MF;
 const double Ratio = 1.0;
@@ -8,7 +9,26 @@ string name = "mf_time_pred_x" + to_string(Ratio);
 vector<Node*> nodes;
 vector<Task*> tasks;
 
+// jobs_info.bin / nodes_info.bin are read instead of the text files when present,
+// the results are then written in the binary format as well
+bool binary_input = false;
+
+void add_nodes(int node_cpu, int node_mem, int num){
+    for(int i = 0; i < num; i++){
+        Node *node = new Node(nodes.size(), {node_cpu, node_mem});
+        nodes.push_back(node);
+    }
+}
+
 void read_node(){
+    if(file_exists("./nodes_info.bin")){
+        BinaryTable table("./nodes_info.bin");
+        vector<int> col = table.columns({"node_cpu", "node_mem", "num"});
+        for(uint64_t i = 0; i < table.rows; i++){
+            add_nodes(table.at(i, col[0]), table.at(i, col[1]), table.at(i, col[2]));
+        }
+        return;
+    }
     ifstream fin;
     fin.open("./nodes_info.txt");
     assert(fin.is_open());
@@ -16,32 +36,44 @@ void read_node(){
     string node_name;
     int num;
     while(fin >> node_cpu >> node_mem >> num){
-        for(int i = 0; i < num; i++){
-            Node *node = new Node(nodes.size(), {node_cpu, node_mem});
-            nodes.push_back(node);
-        }
+        add_nodes(node_cpu, node_mem, num);
     }
     fin.close();
 }
 
+void add_task(int submit_time, int priority, int timelimit, int predict_lgb, int execution_time, int node_num, int cpu_req){
+    cpu_req /= node_num;
+    int predict_time = use_predict ? predict_lgb : timelimit;
+
+    assert(execution_time <= timelimit);
+    assert(predict_time >= 1);
+    assert(predict_time <= timelimit);
+    
+    Task *task = new Task(tasks.size(), submit_time, timelimit, predict_time, node_num, {cpu_req, 0}, execution_time);
+    tasks.push_back(task);
+}
+
 void load_data(){
     read_node();
-    ifstream fin;
-    fin.open("./jobs_info.txt");
-    assert(fin.is_open());
-    int submit_time, priority, timelimit, predict_lgb, execution_time, node_num, cpu_req;
-    while(fin >> submit_time >> priority >> timelimit >> predict_lgb >> execution_time >> node_num >> cpu_req){
-        cpu_req /= node_num;
-        int predict_time = use_predict ? predict_lgb : timelimit;
-
-        assert(execution_time <= timelimit);
-        assert(predict_time >= 1);
-        assert(predict_time <= timelimit);
-        
-        Task *task = new Task(tasks.size(), submit_time, timelimit, predict_time, node_num, {cpu_req, 0}, execution_time);
-        tasks.push_back(task);
+    if(file_exists("./jobs_info.bin")){
+        binary_input = true;
+        BinaryTable table("./jobs_info.bin");
+        vector<int> col = table.columns({"time_submit", "priority", "timelimit", "time_pred", "running_time", "nodes_alloc", "cpus_req"});
+        tasks.reserve(table.rows);
+        for(uint64_t i = 0; i < table.rows; i++){
+            add_task(table.at(i, col[0]), table.at(i, col[1]), table.at(i, col[2]), table.at(i, col[3]), table.at(i, col[4]), table.at(i, col[5]), table.at(i, col[6]));
+        }
+    }
+    else{
+        ifstream fin;
+        fin.open("./jobs_info.txt");
+        assert(fin.is_open());
+        int submit_time, priority, timelimit, predict_lgb, execution_time, node_num, cpu_req;
+        while(fin >> submit_time >> priority >> timelimit >> predict_lgb >> execution_time >> node_num >> cpu_req){
+            add_task(submit_time, priority, timelimit, predict_lgb, execution_time, node_num, cpu_req);
+        }
+        fin.close();
     }
-    fin.close();
 
     sort(tasks.begin(), tasks.end(), [](Task *a, Task *b){
         return a->submit_time < b->submit_time;
@@ -54,6 +86,18 @@ void load_data(){
 }
 
 void save_simulation_result(vector<Task*> tasks){
+    // the analyzer reads the binary result when it exists, never leave one of another run behind
+    remove((name + (binary_input ? "_simulation_result.txt" : "_simulation_result.bin")).c_str());
+    if(binary_input){
+        vector<int32_t> values;
+        values.reserve(tasks.size() * 6);
+        for(auto &task: tasks){
+            values.insert(values.end(), {task->submit_time, task->ended, task->start_time, task->execution_time, task->node_num, task->resource_req.cpu});
+        }
+        write_binary_table(name + "_simulation_result.bin", {"submit_time", "ended", "start_time", "execution_time", "node_num", "cpu_req"}, values);
+        cerr << "saved to " << name + "_simulation_result.bin" << endl;
+        return;
+    }
     ofstream fout;
     fout.open(name + "_simulation_result.txt");
     assert(fout.is_open());
@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+import numpy as np
+from history import top2_history, top2_history_heap, top2_history_sharded
+
+def synthetic_jobs(n, seed=42):
+    rng = np.random.default_rng(seed)
+    user = np.minimum(rng.zipf(1.5, n), 5000) - 1
+    time_submit = np.sort(rng.integers(1_500_000_000, 1_500_000_000 + n // 10 + 1, n))
+    running_time = rng.exponential(3600, n).astype(np.int64)
+    time_start = time_submit + rng.exponential(600, n).astype(np.int64)
+    time_end = time_start + running_time
+    state = np.where(rng.random(n) < 0.8, 3, 5)
+    return user, time_submit, time_end, running_time, state
+
+def check(n, finished):
+    user, time_submit, time_end, running_time, state = synthetic_jobs(n, seed=n)
+    mask = state == 3 if finished else None
+    expect = top2_history_heap(user, time_submit, time_end, running_time, mask)
+    got = top2_history(user, time_submit, time_end, running_time, mask)
+    assert all(np.array_equal(a, b) for a, b in zip(expect, got)), 'mismatch against heap replay'
+    got = top2_history_sharded(user, time_submit, time_end, running_time, mask, processes=2)
+    assert all(np.array_equal(a, b) for a, b in zip(expect, got)), 'sharded mismatch against heap replay'
+
+def bench(n, processes=1):
+    user, time_submit, time_end, running_time, state = synthetic_jobs(n)
+    start = time.perf_counter()
+    if processes > 1:
+        top2_history_sharded(user, time_submit, time_end, running_time, state == 3, processes)
+    else:
+        top2_history(user, time_submit, time_end, running_time, state == 3)
+    elapsed = time.perf_counter() - start
+    print(f'{n:>12,d} rows  {processes:3d} processes  {elapsed:8.2f} s  {n / elapsed:14,.0f} rows/s')
+
+if __name__ == '__main__':
+    sizes = [int(float(arg)) for arg in sys.argv[1:]] or [1_000_000, 10_000_000]
+
+    for finished in (False, True):
+        check(100_000, finished)
+    print('heap replay check passed')
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    for n in sizes:
+        for processes in sorted({1, 2, cores} & set(range(1, cores + 1))):
+            bench(n, processes)
@@ -1,37 +1,101 @@
 import pandas as pd
 import os
-import sys
+import argparse
+from jobtable import META_FILE, ColumnWriter, columnar_path, load_columns
+
+CLEAN_COLUMNS = ['id_user', 'id_qos', 'cpus_req', 'nodes_alloc', 'timelimit', 'time_submit', 'time_start', 'time_end', 'priority', 'state']
+CLEAN_DTYPES = {col: 'int64' for col in CLEAN_COLUMNS}
+CLEAN_DTYPES['id_user'] = str
 
 def read_csv(job_table_path, columns):
     with open(job_table_path, 'r', errors='ignore') as f:
         df = pd.read_csv(f, names=columns, header=None)
     return df
 
-def data_clean(df):
-    cols = ['id_user', 'id_qos', 'cpus_req', 'nodes_alloc', 'timelimit', 'time_submit', 'time_start', 'time_end', 'priority', 'state']
-    df = df[cols]
+def read_csv_chunks(job_table_path, columns, chunk_size):
+    with open(job_table_path, 'r', errors='ignore') as f:
+        for chunk in pd.read_csv(f, names=columns, header=None, usecols=CLEAN_COLUMNS, dtype=CLEAN_DTYPES, chunksize=chunk_size):
+            yield chunk[CLEAN_COLUMNS]
+
+def user_ids_path(output_path):
+    # jobs_table.csv -> jobs_table_users.csv
+    return os.path.splitext(output_path)[0] + '_users.csv'
+
+def load_user_ids(path):
+    if not os.path.exists(path):
+        return {}
+    df = pd.read_csv(path, dtype={'user': str, 'id_user': 'int64'}, keep_default_na=False)
+    return dict(zip(df['user'], df['id_user']))
+
+def save_user_ids(path, user_ids):
+    tmp_path = path + '.tmp'
+    pd.DataFrame({'user': list(user_ids.keys()), 'id_user': list(user_ids.values())}).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def encode_users(users, user_ids):
+    # same codes as pd.factorize over the concatenated chunks, user_ids is updated in place
+    for user in pd.unique(users[~users.isin(user_ids.keys())]):
+        user_ids[user] = len(user_ids)
+    return users.map(user_ids).astype('int64')
 
-    df = df.loc[df['time_start'] != 0]
-    df = df.loc[df['time_end'] != 0]
-    df = df.loc[df['time_submit'] != 0]
-    df = df.loc[df['timelimit'] != 0]
+def data_clean(df, user_ids=None, since=None, verbose=True):
+    df = df[CLEAN_COLUMNS]
 
-    df['id_user'] = pd.factorize(df['id_user'])[0]
+    mask = (df['time_start'] != 0) & (df['time_end'] != 0) & (df['time_submit'] != 0) & (df['timelimit'] != 0)
+    if since is not None:
+        mask &= df['time_submit'] > since
+    df = df.loc[mask].copy()
 
-    print(df.head())
+    df['id_user'] = encode_users(df['id_user'], user_ids if user_ids is not None else {})
+
+    if verbose:
+        print(df.head())
 
     return df
 
-if __name__ == '__main__':
-    job_table_path = sys.argv[1]
-    job_table_desc_path = sys.argv[2]
-    output_path = sys.argv[3]
+def stream_clean(job_table_path, columns, output_path, chunk_size=1000000, append=False, users_path=None):
+    # Peak memory is bounded by chunk_size rows. User ids come from a persisted dictionary, so existing
+    # users keep their ids across runs. In append mode only jobs submitted after the newest job already
+    # in the output are cleaned and appended.
+    users_path = users_path if users_path is not None else user_ids_path(output_path)
+    if append and not os.path.exists(users_path):
+        # the table only has the ids, new users would reuse ids of users already in it
+        raise ValueError(f'{users_path}: no user id dictionary of {output_path}, clean the whole dump again instead of appending')
+    user_ids = load_user_ids(users_path)
+    n_users = len(user_ids)
 
-    job_table_desc = pd.read_csv(job_table_desc_path, header=None)
-    columns = job_table_desc.iloc[0].tolist()
-    df = read_csv(job_table_path, columns)
-    df = data_clean(df)
+    table_path = columnar_path(output_path)
+    since = None
+    if append:
+        if not os.path.exists(output_path) or not os.path.exists(os.path.join(table_path, META_FILE)):
+            raise ValueError(f'{output_path}: no cleaned table to append to')
+        time_submit = load_columns(table_path, ['time_submit'])['time_submit']
+        since = int(time_submit.max()) if len(time_submit) > 0 else None
+    else:
+        pd.DataFrame(columns=CLEAN_COLUMNS).to_csv(output_path, index=False)
+    writer = ColumnWriter(table_path, append=append)
 
-    df.to_csv(output_path, index=False)
+    rows = 0
+    for chunk in read_csv_chunks(job_table_path, columns, chunk_size):
+        chunk = data_clean(chunk, user_ids, since, verbose=rows == 0)
+        chunk.to_csv(output_path, index=False, header=False, mode='a')
+        writer.append(chunk)
+        rows += len(chunk)
+    writer.close()
+    save_user_ids(users_path, user_ids)
 
+    print(f'{rows} jobs, {len(user_ids) - n_users} new users ({len(user_ids)} total) written to {output_path}')
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Clean a raw accounting dump into jobs_table.csv')
+    parser.add_argument('job_table_path')
+    parser.add_argument('job_table_desc_path')
+    parser.add_argument('output_path')
+    parser.add_argument('--chunk-size', type=int, default=1000000, help='rows parsed per chunk')
+    parser.add_argument('--append', action='store_true', help='only add jobs submitted after the newest job in output_path')
+    parser.add_argument('--user-ids', help='persisted user id dictionary (default: <output>_users.csv)')
+    args = parser.parse_args()
+
+    job_table_desc = pd.read_csv(args.job_table_desc_path, header=None)
+    columns = job_table_desc.iloc[0].tolist()
+    stream_clean(args.job_table_path, columns, args.output_path, args.chunk_size, args.append, args.user_ids)
@@ -0,0 +1,41 @@
+import numpy as np
+
+CALENDAR_COLUMNS = ['sub_year', 'sub_quarter', 'sub_month', 'sub_day', 'sub_hour', 'sub_day_of_year', 'sub_day_of_month', 'sub_day_of_week']
+
+def day_table(first_day, last_day):
+    # calendar fields of every day in [first_day, last_day], days counted from 1970-01-01
+    days = np.arange(first_day, last_day + 1, dtype=np.int64)
+    date = days.astype('datetime64[D]')
+    year = date.astype('datetime64[Y]')
+    month = date.astype('datetime64[M]')
+
+    month_num = (month.astype(np.int64) % 12 + 1).astype(np.int8)
+    day = ((date - month).astype(np.int64) + 1).astype(np.int8)
+    return {
+        'sub_year': (year.astype(np.int64) + 1970).astype(np.int16),
+        'sub_quarter': ((month_num - 1) // 3 + 1).astype(np.int8),
+        'sub_month': month_num,
+        'sub_day': day,
+        'sub_day_of_year': ((date - year).astype(np.int64) + 1).astype(np.int16),
+        'sub_day_of_month': day,
+        'sub_day_of_week': ((days + 3) % 7).astype(np.int8), # 1970-01-01 is a Thursday, Monday = 0
+    }
+
+def calendar_features(time_submit):
+    # same values as the pandas .dt accessors on pd.to_datetime(time_submit, unit='s'), in one pass
+    time_submit = np.asarray(time_submit, dtype=np.int64)
+    if len(time_submit) == 0:
+        return {col: np.zeros(0, dtype=np.int16 if col in ('sub_year', 'sub_day_of_year') else np.int8) for col in CALENDAR_COLUMNS}
+
+    day = time_submit // 86400
+    first_day = day.min()
+    table = day_table(first_day, day.max())
+    index = day - first_day
+
+    features = {}
+    for col in CALENDAR_COLUMNS:
+        if col == 'sub_hour':
+            features[col] = ((time_submit - day * 86400) // 3600).astype(np.int8)
+        else:
+            features[col] = table[col][index]
+    return features
@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+from jobtable import compact_dtype, load_job_table
+from profiling import memory_report, stage
+from datefeat import CALENDAR_COLUMNS, calendar_features
+from history import top2_history, history_checkpoint, load_history_state, save_history_state
+
+JOB_COLUMNS = ['id_user', 'id_qos', 'cpus_req', 'nodes_alloc', 'timelimit', 'time_submit', 'time_start', 'time_end', 'priority', 'state']
+FEATURES = ['id_user', 'id_qos', 'cpus_req', 'nodes_alloc', 'timelimit', 'time_submit'] + CALENDAR_COLUMNS + ['top1_time', 'top2_time', 'top2_mean']
+LABEL = 'running_time'
+
+TRAIN_COLUMNS = ['id_user', 'id_qos', 'cpus_req', 'nodes_alloc', 'timelimit', 'time_submit', LABEL] + FEATURES[6:]
+PREDICT_COLUMNS = ['id_user', 'id_qos', 'cpus_req', 'nodes_alloc', 'timelimit', 'time_submit', 'priority', 'state', LABEL] + FEATURES[6:]
+CARRY_COLUMNS = TRAIN_COLUMNS + ['time_end']
+
+def compact_dtypes(df):
+    # Integer columns (including the id_user / id_qos codes) get the smallest integer dtype that
+    # holds them, float columns become float32 when that is exact
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype.kind in 'iu':
+            df[col] = values.astype(compact_dtype(values), copy=False)
+        elif values.dtype == np.float64 and np.array_equal(values.astype(np.float32), values, equal_nan=True):
+            df[col] = values.astype(np.float32)
+    return df
+
+def model_input(df):
+    # LightGBM only sees binned features, float32 halves the matrix compared to float64
+    return df[FEATURES].to_numpy(dtype=np.float32)
+
+def load_jobs(job_table_path, before=None, since=None):
+    # jobs submitted in [since, before), with running_time and calendar features, sorted by time_submit
+    with stage('read'):
+        data = load_job_table(job_table_path, JOB_COLUMNS)
+    memory_report('load', data)
+
+    with stage('filter'):
+        mask = np.ones(len(data), dtype=bool)
+        if before is not None:
+            mask &= (data['time_submit'] < before).to_numpy()
+        if since is not None:
+            mask &= (data['time_submit'] >= since).to_numpy()
+        data = data.loc[mask]
+
+        data['timelimit'] = data['timelimit'].astype('int64') * 60
+        data['running_time'] = data['time_end'] - data['time_start']
+        data = data[data['running_time'] <= data['timelimit'] + 60]
+
+    with stage('calendar'):
+        for col, values in calendar_features(data['time_submit'].to_numpy()).items():
+            data[col] = values
+
+    with stage('sort'):
+        data = compact_dtypes(data.sort_values(by='time_submit', kind='stable').reset_index(drop=True))
+    memory_report('jobs', data)
+    return data
+
+def _history_cols(data):
+    return data['id_user'].to_numpy(), data['time_submit'].to_numpy(), data['time_end'].to_numpy(), data['running_time'].to_numpy()
+
+def jobs_history(jobs, state=None):
+    # top1/top2 of every job, only state == 3 jobs count as finished
+    with stage('history'):
+        return top2_history(*_history_cols(jobs), jobs['state'].to_numpy() == 3, state=state)
+
+def _with_history(data, top1, top2, columns):
+    with stage('assemble'):
+        data['top1_time'], data['top2_time'] = top1, top2
+        data['top2_mean'] = data[['top1_time', 'top2_time']].mean(axis=1)
+        data = compact_dtypes(data[columns])
+    memory_report('features', data)
+    return data
+
+def _carried_rows(state):
+    # training rows saved with a train checkpoint: jobs submitted before its cutoff that ended at or after it
+    if state is None or 'carry_time_end' not in state:
+        return None
+    return pd.DataFrame({col: state['carry_' + col] for col in CARRY_COLUMNS})
+
+def train_features(jobs, test_start_time, state=None, checkpoint_path=None, checkpoint_time=None, history=None, ended_since=None):
+    # Finished (state == 3) jobs that ended before test_start_time (and not before ended_since). Resuming
+    # from or saving a checkpoint replays every finished job and filters on time_end afterwards, so the
+    # checkpoint stays valid for later cutoffs. A checkpoint keeps the rows of the jobs still running at its
+    # cutoff, a resumed run returns them with the new jobs: every finished job that ended since the cutoff,
+    # as a full replay would. history is the jobs_history of the same jobs frame, reused when that is exact.
+    resumable = state is not None or checkpoint_path is not None
+    finished = (jobs['state'] == 3).to_numpy()
+    keep = finished & (jobs['time_end'] < test_start_time).to_numpy()
+
+    if resumable:
+        data = jobs.loc[finished].reset_index(drop=True)
+        with stage('history'):
+            top1, top2 = top2_history(*_history_cols(data), state=state)
+        checkpoint = None
+        if checkpoint_path is not None:
+            with stage('checkpoint'):
+                checkpoint = history_checkpoint(*_history_cols(data), checkpoint_time if checkpoint_time is not None else test_start_time, state=state)
+                checkpoint['variant'] = 'train'
+        data = _with_history(data, top1, top2, CARRY_COLUMNS)
+        carried = _carried_rows(state)
+        if carried is not None:
+            data = compact_dtypes(pd.concat([carried, data], ignore_index=True))
+        if checkpoint is not None:
+            with stage('checkpoint'):
+                cutoff = checkpoint['cutoff']
+                running = data.loc[(data['time_submit'] < cutoff) & (data['time_end'] >= cutoff)]
+                for col in CARRY_COLUMNS:
+                    checkpoint['carry_' + col] = running[col].to_numpy()
+                save_history_state(checkpoint_path, checkpoint)
+        mask = data['time_end'] < test_start_time
+        if ended_since is not None:
+            mask &= data['time_end'] >= ended_since
+        return data.loc[mask, TRAIN_COLUMNS].reset_index(drop=True)
+
+    data = jobs.loc[keep].reset_index(drop=True)
+    # a job ending before test_start_time only sees jobs that ended before it was submitted, which
+    # is unaffected by the cutoff as long as no kept job ends before it was submitted
+    if history is not None and (data['time_submit'] <= data['time_end']).all():
+        top1, top2 = history[0][keep], history[1][keep]
+    else:
+        with stage('history'):
+            top1, top2 = top2_history(*_history_cols(data))
+    if ended_since is not None:
+        recent = (data['time_end'] >= ended_since).to_numpy()
+        data, top1, top2 = data.loc[recent].reset_index(drop=True), top1[recent], top2[recent]
+    return _with_history(data, top1, top2, TRAIN_COLUMNS)
+
+def walk_forward_features(jobs, last_cutoff, history):
+    # The training set of last_cutoff with time_end kept, the training set of any earlier cutoff is
+    # its rows with time_end < cutoff. That slicing reuses history the way train_features does, so it
+    # is exact under the same condition; None when a job ends before it was submitted.
+    keep = (jobs['state'] == 3).to_numpy() & (jobs['time_end'] < last_cutoff).to_numpy()
+    data = jobs.loc[keep].reset_index(drop=True)
+    if not (data['time_submit'] <= data['time_end']).all():
+        return None
+    return _with_history(data, history[0][keep], history[1][keep], TRAIN_COLUMNS + ['time_end'])
+
+def predict_features(jobs, test_end_time, state=None, checkpoint_path=None, history=None):
+    # every job submitted before test_end_time, later jobs never change the features of earlier ones
+    keep = (jobs['time_submit'] < test_end_time).to_numpy()
+    data = jobs.loc[keep].reset_index(drop=True)
+
+    if history is not None and state is None:
+        top1, top2 = history[0][keep], history[1][keep]
+    else:
+        top1, top2 = jobs_history(data, state)
+    if checkpoint_path is not None:
+        with stage('checkpoint'):
+            checkpoint = history_checkpoint(*_history_cols(data), test_end_time, data['state'].to_numpy() == 3, state=state)
+            checkpoint['variant'] = 'predict'
+            save_history_state(checkpoint_path, checkpoint)
+    return _with_history(data, top1, top2, PREDICT_COLUMNS)
+
+def feature_extract_train(job_table_path, test_start_time, state_path=None, checkpoint_path=None, checkpoint_time=None):
+    # state_path resumes from a saved history checkpoint, only jobs submitted after its cutoff are read and
+    # the jobs that ended since it are returned. checkpoint_path saves the history state at checkpoint_time
+    # (test_start_time by default)
+    state = load_history_state(state_path, 'train') if state_path is not None else None
+    jobs = load_jobs(job_table_path, since=state['cutoff'] if state is not None else None)
+    return train_features(jobs, test_start_time, state, checkpoint_path, checkpoint_time)
+
+def feature_extract_predict(job_table_path, test_end_time, state_path=None, checkpoint_path=None):
+    # state_path resumes from a saved history checkpoint and only returns jobs submitted after its cutoff,
+    # checkpoint_path saves the history state at test_end_time
+    state = load_history_state(state_path, 'predict') if state_path is not None else None
+    jobs = load_jobs(job_table_path, before=test_end_time, since=state['cutoff'] if state is not None else None)
+    return predict_features(jobs, test_end_time, state, checkpoint_path)
+
+def feature_extract(job_table_path, test_start_time, test_end_time):
+    # training set before test_start_time and prediction set before test_end_time from one scan
+    jobs = load_jobs(job_table_path)
+    history = jobs_history(jobs)
+    return train_features(jobs, test_start_time, history=history), predict_features(jobs, test_end_time, history=history)
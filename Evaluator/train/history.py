@@ -0,0 +1,247 @@
+import os
+import mmap
+import heapq
+import multiprocessing
+import numpy as np
+
+STATE_VERSION = 1
+
+# processes for the user-sharded history, see set_workers
+workers = 1
+MIN_SHARDED_ROWS = 1 << 18
+SHARDS_PER_WORKER = 4
+
+_shard_job = None
+
+def set_workers(n):
+    # top2_history runs on n forked processes for tables of at least MIN_SHARDED_ROWS rows
+    global workers
+    workers = max(1, n)
+
+def _group_cummax(group, values):
+    # running max of non-negative values, restarted at every group; group must be sorted
+    span = np.int64(values.max()) + 1 if len(values) > 0 else np.int64(1)
+    offset = group.astype(np.int64) * span
+    return np.maximum.accumulate(values + offset) - offset
+
+def empty_history_state(cutoff=0):
+    empty = np.zeros(0, dtype=np.int64)
+    return {
+        'version': STATE_VERSION,
+        'variant': '',
+        'cutoff': cutoff,
+        'seen': 0,
+        'fin_user': empty, 'fin_seq': empty, 'fin_rt': empty, # two latest finished jobs per user
+        'run_user': empty, 'run_seq': empty, 'run_rt': empty, 'run_end': empty, # jobs ending at or after cutoff
+    }
+
+def _prior_jobs(state, time_submit):
+    # jobs carried over from a checkpoint, sorted by their global row index
+    state = state if state is not None else empty_history_state()
+    n_fin = len(state['fin_seq'])
+    user = np.concatenate([state['fin_user'], state['run_user']])
+    seq = np.concatenate([state['fin_seq'], state['run_seq']])
+    running_time = np.concatenate([state['fin_rt'], state['run_rt']])
+    time_end = np.concatenate([np.full(n_fin, np.iinfo(np.int64).min, dtype=np.int64), state['run_end']])
+    visible = np.concatenate([np.zeros(n_fin, dtype=np.int64),
+                              np.searchsorted(time_submit, state['run_end'], side='right').astype(np.int64)])
+    order = np.argsort(seq, kind='stable')
+    return user[order], seq[order], running_time[order], time_end[order], visible[order], state['seen']
+
+def top2_history(user, time_submit, time_end, running_time, finished=None, state=None):
+    if state is None and workers > 1 and len(user) >= MIN_SHARDED_ROWS and 'fork' in multiprocessing.get_all_start_methods():
+        return top2_history_sharded(user, time_submit, time_end, running_time, finished, workers)
+    return _top2_history(user, time_submit, time_end, running_time, finished, state)
+
+def _top2_history(user, time_submit, time_end, running_time, finished=None, state=None):
+    # Columnar equivalent of the pq_running / pq_finished replay in feature_extract.
+    # Rows must be sorted by time_submit. Job j enters its user's finished set right
+    # before the first row i > j with time_submit[i] > time_end[j]; row i then reads
+    # the running times of the two largest indices in that set. A checkpoint state
+    # resumes the replay, rows must then all be submitted at or after its cutoff.
+    user = np.asarray(user)
+    time_submit = np.asarray(time_submit)
+    time_end = np.asarray(time_end)
+    running_time = np.asarray(running_time)
+    n = len(user)
+
+    top1 = np.zeros(n, dtype=running_time.dtype)
+    top2 = np.zeros(n, dtype=running_time.dtype)
+    if n == 0:
+        return top1, top2
+
+    p_user, _, p_rt, _, p_visible, _ = _prior_jobs(state, time_submit)
+    n_prior = len(p_user)
+
+    _, uid = np.unique(np.concatenate([p_user, user]), return_inverse=True)
+    uid = uid.astype(np.int64).reshape(-1)
+    row = np.arange(n, dtype=np.int64)
+
+    visible = np.searchsorted(time_submit, time_end, side='right').astype(np.int64)
+    visible = np.maximum(visible, row + 1)
+    pushed = np.ones(n, dtype=bool) if finished is None else np.asarray(finished, dtype=bool)
+
+    # prior jobs come first, so positions in the joint arrays keep the global row order
+    job = np.concatenate([np.arange(n_prior, dtype=np.int64), n_prior + np.flatnonzero(pushed)])
+    job_visible = np.concatenate([p_visible, visible[pushed]])
+    job = job[job_visible < n]
+    job_visible = job_visible[job_visible < n]
+    if len(job) == 0:
+        return top1, top2
+    all_rt = np.concatenate([p_rt.astype(running_time.dtype), running_time])
+
+    # finish events grouped by user, in the order they become visible
+    key = uid[job] * (n + 1) + job_visible
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+    job = job[order]
+    group = uid[job]
+
+    # running top-2 of job indices: the new second best is max(second, min(new, best))
+    m1 = _group_cummax(group, job)
+    m1_prev = np.empty_like(m1)
+    m1_prev[0] = -1
+    m1_prev[1:] = m1[:-1]
+    m1_prev[np.flatnonzero(group[1:] != group[:-1]) + 1] = -1
+    m2 = _group_cummax(group, np.minimum(job, m1_prev) + 1) - 1
+
+    # latest event of the same user that is visible at each row
+    q_uid = uid[n_prior:]
+    pos = np.searchsorted(key, q_uid * (n + 1) + row, side='right') - 1
+    hit = pos >= 0
+    hit[hit] = group[pos[hit]] == q_uid[hit]
+
+    rows = np.flatnonzero(hit)
+    best = m1[pos[rows]]
+    second = m2[pos[rows]]
+    top1[rows] = all_rt[best]
+    top2[rows] = np.where(second >= 0, all_rt[np.maximum(second, 0)], all_rt[best])
+    return top1, top2
+
+def _shard_of(user, shards):
+    # multiplicative hash, so that consecutive user codes spread over the shards
+    user = np.asarray(user).astype(np.uint64)
+    return ((user * np.uint64(2654435761)) % np.uint64(1 << 32) % np.uint64(shards)).astype(np.uint16)
+
+def _shared_zeros(n, dtype):
+    # anonymous shared mapping, forked workers write into it and the parent reads it
+    return np.frombuffer(mmap.mmap(-1, max(1, n * np.dtype(dtype).itemsize)), dtype=dtype, count=n)
+
+def _shard_history(shard):
+    user, time_submit, time_end, running_time, finished, index, bounds, top1, top2 = _shard_job
+    rows = index[bounds[shard]:bounds[shard + 1]]
+    if len(rows) > 0:
+        top1[rows], top2[rows] = _top2_history(user[rows], time_submit[rows], time_end[rows], running_time[rows],
+                                               None if finished is None else finished[rows])
+    return len(rows)
+
+def top2_history_sharded(user, time_submit, time_end, running_time, finished=None, processes=2, shards=None):
+    # top2_history with users hashed into shards that forked processes compute independently. The
+    # features of a row only depend on the jobs of its user and on their time_submit order, which every
+    # shard keeps, so the result is exact. More shards than processes even out heavy users.
+    global _shard_job
+    user = np.asarray(user)
+    running_time = np.asarray(running_time)
+    n = len(user)
+    shards = shards or SHARDS_PER_WORKER * processes
+
+    shard = _shard_of(user, shards)
+    index = np.argsort(shard, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(shard, minlength=shards))])
+    top1 = _shared_zeros(n, running_time.dtype)
+    top2 = _shared_zeros(n, running_time.dtype)
+
+    # forked workers inherit the inputs instead of receiving pickled copies
+    _shard_job = (user, np.asarray(time_submit), np.asarray(time_end), running_time,
+                  None if finished is None else np.asarray(finished, dtype=bool), index, bounds, top1, top2)
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            for _ in pool.imap_unordered(_shard_history, range(shards)):
+                pass
+    finally:
+        _shard_job = None
+    return top1.copy(), top2.copy()
+
+def history_checkpoint(user, time_submit, time_end, running_time, cutoff, finished=None, state=None):
+    # state after replaying every row submitted before cutoff, on top of an optional earlier state
+    time_submit = np.asarray(time_submit)
+    if state is not None and cutoff < state['cutoff']:
+        raise ValueError(f'checkpoint cutoff {cutoff} is before the resumed cutoff {state["cutoff"]}')
+
+    p_user, p_seq, p_rt, p_end, _, seen = _prior_jobs(state, time_submit)
+
+    n = int(np.searchsorted(time_submit, cutoff, side='left'))
+    pushed = np.ones(n, dtype=bool) if finished is None else np.asarray(finished, dtype=bool)[:n]
+    job = np.flatnonzero(pushed)
+
+    user = np.concatenate([p_user, np.asarray(user)[job]]).astype(np.int64)
+    seq = np.concatenate([p_seq, seen + job]).astype(np.int64)
+    running_time = np.concatenate([p_rt, np.asarray(running_time)[job]]).astype(np.int64)
+    time_end = np.concatenate([p_end, np.asarray(time_end)[job]]).astype(np.int64)
+
+    done = time_end < cutoff
+    fin_user, fin_seq, fin_rt = user[done], seq[done], running_time[done]
+    order = np.lexsort((fin_seq, fin_user))
+    fin_user, fin_seq, fin_rt = fin_user[order], fin_seq[order], fin_rt[order]
+    # keep the two largest row indices of every user
+    last = np.ones(len(fin_user), dtype=bool)
+    last[:-2] = fin_user[:-2] != fin_user[2:]
+
+    checkpoint = empty_history_state(cutoff)
+    checkpoint['variant'] = state['variant'] if state is not None else ''
+    checkpoint['seen'] = seen + n
+    checkpoint['fin_user'], checkpoint['fin_seq'], checkpoint['fin_rt'] = fin_user[last], fin_seq[last], fin_rt[last]
+    checkpoint['run_user'], checkpoint['run_seq'] = user[~done], seq[~done]
+    checkpoint['run_rt'], checkpoint['run_end'] = running_time[~done], time_end[~done]
+    return checkpoint
+
+def save_history_state(path, state):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(path, 'wb') as f:
+        np.savez(f, **state)
+
+def load_history_state(path, variant=None):
+    with np.load(path, allow_pickle=False) as f:
+        state = {key: f[key] for key in f.files}
+    if int(state.get('version', -1)) != STATE_VERSION:
+        raise ValueError(f'{path}: unsupported history state version {state.get("version")}, expected {STATE_VERSION}')
+    for key in ('version', 'cutoff', 'seen'):
+        state[key] = int(state[key])
+    state['variant'] = str(state['variant'])
+    if variant is not None and state['variant'] != variant:
+        raise ValueError(f'{path}: history state was built for {state["variant"]!r}, not {variant!r}')
+    return state
+
+def top2_history_heap(user, time_submit, time_end, running_time, finished=None):
+    # reference implementation, replays the original heaps row by row
+    n = len(user)
+    top1 = np.zeros(n, dtype=np.asarray(running_time).dtype)
+    top2 = np.zeros(n, dtype=np.asarray(running_time).dtype)
+
+    pq_running = [] # (time_end, idx), sorted by time_end
+    pq_finished = {} # group by user, (idx, running_time), sorted by idx
+    for idx in range(n):
+        while len(pq_running) > 0 and pq_running[0][0] < time_submit[idx]:
+            _, idx_ = heapq.heappop(pq_running)
+            user_ = user[idx_]
+            if user_ not in pq_finished:
+                pq_finished[user_] = []
+            heapq.heappush(pq_finished[user_], (idx_, running_time[idx_]))
+            if len(pq_finished[user_]) > 2:
+                heapq.heappop(pq_finished[user_])
+
+        finished_ = pq_finished.get(user[idx])
+        if finished_ is None:
+            pass
+        elif len(finished_) == 1:
+            top1[idx] = finished_[0][1]
+            top2[idx] = finished_[0][1]
+        else:
+            top1[idx] = finished_[1][1]
+            top2[idx] = finished_[0][1]
+
+        if finished is None or finished[idx]:
+            heapq.heappush(pq_running, (time_end[idx], idx))
+    return top1, top2
@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+
+TABLE_VERSION = 1
+META_FILE = 'meta.json'
+
+def columnar_path(path):
+    # jobs_table.csv -> jobs_table.cols/
+    return os.path.splitext(path)[0] + '.cols'
+
+def compact_dtype(values):
+    if values.dtype.kind not in 'iub':
+        return values.dtype
+    lo, hi = (values.min(), values.max()) if len(values) > 0 else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        if np.iinfo(dtype).min <= lo and hi <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return values.dtype
+
+class ColumnWriter:
+    # Appends DataFrame chunks to a columnar table. Dtypes start as compact as the first chunk allows
+    # and a column file is rewritten wider when a later chunk does not fit.
+    # meta.json is only written by close(), so a partial table is never read.
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.rows = 0
+        self.dtypes = {}
+        if not os.path.exists(path):
+            os.makedirs(path)
+        meta_path = os.path.join(path, META_FILE)
+        if append and os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta['version'] != TABLE_VERSION:
+                raise ValueError(f'{path}: unsupported table version {meta["version"]}, expected {TABLE_VERSION}')
+            self.rows = meta['rows']
+            self.dtypes = {col: np.dtype(dtype) for col, dtype in meta['columns'].items()}
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+    def _file(self, col):
+        return os.path.join(self.path, col + '.bin')
+
+    def _widen(self, col, dtype, block=1 << 22):
+        tmp_path = self._file(col) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            if self.rows > 0:
+                old = np.memmap(self._file(col), dtype=self.dtypes[col], mode='r', shape=(self.rows,))
+                for start in range(0, self.rows, block):
+                    old[start:start + block].astype(dtype).tofile(f)
+                del old
+        os.replace(tmp_path, self._file(col))
+        self.dtypes[col] = dtype
+
+    def append(self, df):
+        if self.dtypes and list(df.columns) != list(self.dtypes):
+            raise ValueError(f'{self.path}: columns {list(df.columns)} do not match {list(self.dtypes)}')
+        for col in df.columns:
+            values = df[col].to_numpy()
+            if values.dtype.kind not in 'iubf':
+                raise ValueError(f'column {col} has non-numeric dtype {values.dtype}')
+            dtype = compact_dtype(values).newbyteorder('<')
+            if col not in self.dtypes:
+                self.dtypes[col] = dtype
+                open(self._file(col), 'wb').close()
+            elif np.promote_types(self.dtypes[col], dtype) != self.dtypes[col]:
+                self._widen(col, np.promote_types(self.dtypes[col], dtype).newbyteorder('<'))
+            with open(self._file(col), 'ab') as f:
+                values.astype(self.dtypes[col], copy=False).tofile(f)
+        self.rows += len(df)
+
+    def close(self):
+        columns = {col: dtype.str for col, dtype in self.dtypes.items()}
+        with open(os.path.join(self.path, META_FILE), 'w') as f:
+            json.dump({'version': TABLE_VERSION, 'rows': self.rows, 'columns': columns}, f, indent=1)
+
+def save_columns(df, path):
+    writer = ColumnWriter(path)
+    writer.append(df)
+    writer.close()
+
+def load_columns(path, columns=None):
+    with open(os.path.join(path, META_FILE), 'r') as f:
+        meta = json.load(f)
+    if meta['version'] != TABLE_VERSION:
+        raise ValueError(f'{path}: unsupported table version {meta["version"]}, expected {TABLE_VERSION}')
+    if columns is None:
+        columns = list(meta['columns'])
+    missing = [col for col in columns if col not in meta['columns']]
+    if missing:
+        raise KeyError(f'{path}: missing columns {missing}')
+
+    data = {}
+    for col in columns:
+        dtype = np.dtype(meta['columns'][col])
+        if meta['rows'] == 0:
+            data[col] = np.zeros(0, dtype=dtype)
+        else:
+            data[col] = np.memmap(os.path.join(path, col + '.bin'), dtype=dtype, mode='r', shape=(meta['rows'],)).view(np.ndarray)
+    return pd.DataFrame(data, copy=False)
+
+def load_job_table(path, columns=None):
+    # prefer the columnar copy next to the csv, unless the csv has been rewritten since
+    cols_path = path if os.path.isdir(path) else columnar_path(path)
+    meta_path = os.path.join(cols_path, META_FILE)
+    if os.path.exists(meta_path) and (not os.path.isfile(path) or os.path.getmtime(meta_path) >= os.path.getmtime(path)):
+        return load_columns(cols_path, columns)
+
+    with open(path, 'r', errors='ignore') as f:
+        data = pd.read_csv(f, usecols=columns)
+    return data if columns is None else data[columns]
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python jobtable.py jobs_table.csv ...')
+        sys.exit(1)
+
+    for csv_path in sys.argv[1:]:
+        with open(csv_path, 'r', errors='ignore') as f:
+            df = pd.read_csv(f)
+        save_columns(df, columnar_path(csv_path))
+        print(f'{csv_path} -> {columnar_path(csv_path)} ({len(df)} rows)')
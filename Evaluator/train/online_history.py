@@ -0,0 +1,112 @@
+import os
+import sys
+import heapq
+import numpy as np
+from history import empty_history_state, save_history_state, load_history_state
+
+class OnlineHistory:
+    # top1_time / top2_time of jobs as they are submitted, updated from completion events instead of a
+    # replay of the job table. Every submitted job gets the next row index (seq) of the replay. A
+    # completed job waits in pending until a job is submitted after its time_end and then enters its
+    # user's two latest finished jobs, the two largest seq like pq_finished. Jobs are expected in
+    # time_submit order; a job submitted before the cutoff (e.g. reordered over concurrent connections)
+    # is served from the current state and counted in late. The state is a history state (history.py),
+    # so it is restored from a data_loader / train.py checkpoint as well as from its own snapshots.
+
+    def __init__(self, state=None):
+        state = state if state is not None else empty_history_state()
+        self.cutoff = int(state['cutoff'])
+        self.seen = int(state['seen'])
+        self.late = 0
+        # user -> (seq1, rt1, seq2, rt2), seq1 > seq2 and seq2 = -1 while there is only one
+        self.finished = {}
+        for user, seq, rt in zip(state['fin_user'].tolist(), state['fin_seq'].tolist(), state['fin_rt'].tolist()):
+            self._push(user, seq, rt)
+        # (time_end, seq, user, running_time) of completed jobs not visible yet
+        self.pending = list(zip(state['run_end'].tolist(), state['run_seq'].tolist(), state['run_user'].tolist(), state['run_rt'].tolist()))
+        heapq.heapify(self.pending)
+        # job_id -> (user, seq) of submitted jobs without a completion event yet
+        self.running = {}
+        if 'live_job' in state:
+            for job_id, user, seq in zip(state['live_job'].tolist(), state['live_user'].tolist(), state['live_seq'].tolist()):
+                self.running[job_id] = (user, seq)
+
+    @classmethod
+    def load(cls, path):
+        return cls(load_history_state(path))
+
+    def _push(self, user, seq, running_time):
+        entry = self.finished.get(user)
+        if entry is None:
+            self.finished[user] = (seq, running_time, -1, 0)
+        elif seq > entry[0]:
+            self.finished[user] = (seq, running_time, entry[0], entry[1])
+        elif seq > entry[2]:
+            self.finished[user] = (entry[0], entry[1], seq, running_time)
+
+    def advance(self, time_submit):
+        # completed jobs that ended before time_submit become visible
+        while self.pending and self.pending[0][0] < time_submit:
+            _, seq, user, running_time = heapq.heappop(self.pending)
+            self._push(user, seq, running_time)
+        self.cutoff = max(self.cutoff, time_submit)
+
+    def top2(self, user):
+        entry = self.finished.get(user)
+        if entry is None:
+            return 0, 0
+        return entry[1], entry[3] if entry[2] >= 0 else entry[1]
+
+    def submit(self, job_id, user, time_submit):
+        # top1_time, top2_time of a job submitted at time_submit, which then takes the next seq
+        if time_submit < self.cutoff:
+            self.late += 1
+        self.advance(time_submit)
+        top1, top2 = self.top2(user)
+        if job_id is not None:
+            self.running[job_id] = (user, self.seen)
+        self.seen += 1
+        return top1, top2
+
+    def finish(self, job_id, time_end, running_time, completed=True):
+        # only completed jobs count as finished, like state == 3 offline; False for an unknown job
+        job = self.running.pop(job_id, None)
+        if job is None:
+            return False
+        if completed:
+            heapq.heappush(self.pending, (time_end, job[1], job[0], running_time))
+        return True
+
+    def state(self):
+        state = empty_history_state(self.cutoff)
+        state['variant'] = 'online'
+        state['seen'] = self.seen
+        fin = []
+        for user in sorted(self.finished):
+            seq1, rt1, seq2, rt2 = self.finished[user]
+            if seq2 >= 0:
+                fin.append((user, seq2, rt2))
+            fin.append((user, seq1, rt1))
+        pending = sorted(self.pending, key=lambda event: event[1])
+        for keys, rows in ((('fin_user', 'fin_seq', 'fin_rt'), fin),
+                           (('run_end', 'run_seq', 'run_user', 'run_rt'), pending),
+                           (('live_job', 'live_user', 'live_seq'), [(job_id, user, seq) for job_id, (user, seq) in self.running.items()])):
+            columns = np.array(rows, dtype=np.int64).reshape(len(rows), len(keys))
+            for i, key in enumerate(keys):
+                state[key] = columns[:, i].copy()
+        return state
+
+    def save(self, path):
+        # written aside and renamed, a crash mid-snapshot keeps the previous one
+        save_history_state(path + '.tmp', self.state())
+        os.replace(path + '.tmp', path)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python online_history.py state.npz ...')
+        sys.exit(1)
+
+    for path in sys.argv[1:]:
+        history = OnlineHistory.load(path)
+        print(f'{path}: cutoff {history.cutoff}, {history.seen} jobs seen, {len(history.finished)} users, '
+              f'{len(history.pending)} pending, {len(history.running)} running')
@@ -0,0 +1,117 @@
+import os
+import sys
+import hashlib
+import numpy as np
+import pandas as pd
+from tree_model import load_predictor
+
+CACHE_VERSION = 1
+
+def model_hash(model_path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(model_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def row_keys(X):
+    # 64-bit hash of every feature row, equal rows get equal keys whatever job they belong to
+    return pd.util.hash_pandas_object(pd.DataFrame(np.asarray(X, dtype=np.float64)), index=False).to_numpy()
+
+def prediction_cache_path_of(model_path):
+    # model.txt -> predictions.npz
+    return os.path.join(os.path.dirname(model_path), 'predictions.npz')
+
+def _merge(keys, values, new_keys, new_values):
+    # sorted unique keys, entries of keys win over new_keys
+    keys = np.concatenate([keys, new_keys])
+    values = np.concatenate([values, new_values])
+    keys, first = np.unique(keys, return_index=True)
+    return keys, values[first]
+
+class PredictionCache:
+    # Predictions of one model.txt keyed by the hash of the feature row, persisted as sorted arrays in
+    # an npz next to the model. The file records the hash of the model it was made with, its entries are
+    # evicted once model.txt changes. The model itself is only loaded when a row misses, with the engine
+    # chosen for the number of rows that missed first. Misses are merged in by save, a row repeated before
+    # then is predicted again.
+
+    def __init__(self, model_path, cache_path=None, engine='auto'):
+        self.model_path = model_path
+        self.engine = engine
+        self.cache_path = cache_path or prediction_cache_path_of(model_path)
+        self.model_hash = model_hash(model_path)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # predictions of the rows that missed, merged into keys / values once, by save
+        self.new_keys = []
+        self.new_values = []
+        self._model = None
+        stored = self._read()
+        if stored is None:
+            stored = np.zeros(0, np.uint64), np.zeros(0, np.float64)
+        self.keys, self.values = stored
+
+    def _read(self):
+        # entries on disk, None when there are none or they were made by another model
+        if not os.path.exists(self.cache_path):
+            return None
+        with np.load(self.cache_path) as cache:
+            if int(cache['version']) != CACHE_VERSION or str(cache['model_hash']) != self.model_hash:
+                self.evicted = len(cache['keys'])
+                return None
+            return cache['keys'], cache['values']
+
+    def model(self, rows):
+        if self._model is None:
+            self._model = load_predictor(self.model_path, rows, self.engine)
+        return self._model
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        keys = row_keys(X)
+        y = np.empty(len(X), dtype=np.float64)
+        pos = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        found = self.keys[pos] == keys if len(self.keys) > 0 else np.zeros(len(X), dtype=bool)
+        y[found] = self.values[pos[found]]
+
+        missing = ~found
+        if missing.any():
+            y[missing] = self.model(int(missing.sum())).predict(X[missing])
+            self.new_keys.append(keys[missing])
+            self.new_values.append(y[missing])
+        self.hits += int(found.sum())
+        self.misses += int(missing.sum())
+        return y
+
+    def save(self):
+        if not self.new_keys:
+            return
+        self.keys, self.values = _merge(self.keys, self.values, np.concatenate(self.new_keys), np.concatenate(self.new_values))
+        self.new_keys, self.new_values = [], []
+        # keep what other processes saved for the same model meanwhile
+        stored = self._read()
+        if stored is not None:
+            self.keys, self.values = _merge(self.keys, self.values, *stored)
+        tmp_path = f'{self.cache_path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, version=CACHE_VERSION, model_hash=self.model_hash, keys=self.keys, values=self.values)
+        os.replace(tmp_path, self.cache_path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evicted': self.evicted, 'entries': len(self.keys)}
+
+    def summary(self):
+        stats = self.stats()
+        return (f'prediction cache {self.cache_path}: {stats["hits"]} hits, {stats["misses"]} misses ({stats["hit_rate"]:.1%} hit rate), '
+                f'{stats["entries"]} entries, {stats["evicted"]} evicted')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python prediction_cache.py model.txt ...')
+        sys.exit(1)
+
+    for model_path in sys.argv[1:]:
+        print(PredictionCache(model_path).summary())
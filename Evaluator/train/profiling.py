@@ -0,0 +1,69 @@
+import sys
+import json
+import time
+import resource
+import numpy as np
+from contextlib import contextmanager
+
+enabled = False
+timing = False
+stages = []
+_depth = 0
+
+def enable():
+    global enabled
+    enabled = True
+
+def enable_timing():
+    global timing
+    timing = True
+
+def peak_rss():
+    # bytes; ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def _mib(nbytes):
+    return f'{nbytes / 2**20:10.2f} MiB'
+
+def memory_report(stage, data=None):
+    # per-column bytes of a DataFrame (or the size of an array) and the peak RSS so far
+    if not enabled:
+        return
+    if data is None:
+        print(f'[memory] {stage}: peak RSS {_mib(peak_rss())}')
+    elif isinstance(data, np.ndarray):
+        print(f'[memory] {stage}: {data.shape} {data.dtype} {_mib(data.nbytes)}, peak RSS {_mib(peak_rss())}')
+    else:
+        usage = data.memory_usage(index=False, deep=True)
+        print(f'[memory] {stage}: {len(data)} rows {_mib(usage.sum())}, peak RSS {_mib(peak_rss())}')
+        for col, nbytes in usage.items():
+            print(f'[memory]     {col:<18} {str(data[col].dtype):<8} {_mib(nbytes)}')
+
+@contextmanager
+def stage(name):
+    # wall time, CPU time (all threads of this process) and peak RSS of a named stage, stages may nest
+    global _depth
+    if not timing:
+        yield
+        return
+    wall, cpu = time.perf_counter(), time.process_time()
+    _depth += 1
+    try:
+        yield
+    finally:
+        _depth -= 1
+        stages.append({
+            'stage': name, 'depth': _depth,
+            'wall_time': round(time.perf_counter() - wall, 6), 'cpu_time': round(time.process_time() - cpu, 6),
+            'peak_rss': peak_rss(),
+        })
+        print(f'[timing] {"  " * _depth}{name}: wall {stages[-1]["wall_time"]:.3f}s, cpu {stages[-1]["cpu_time"]:.3f}s, peak RSS {_mib(peak_rss())}')
+
+def save_timing(path, **info):
+    # JSON report of the recorded stages, in the order they finished
+    if not timing:
+        return
+    with open(path, 'w') as f:
+        json.dump(dict(info, stages=stages), f, indent=1)
+    print(f'[timing] report saved to {path}')
@@ -0,0 +1,29 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DAY = 24 * 3600
+START = 1600000000
+
+@pytest.fixture
+def job_table(tmp_path):
+    # jobs_table.csv of a few users over 30 days, running times depend on the user and the qos
+    rng = np.random.default_rng(0)
+    n = 3000
+    time_submit = np.sort(rng.integers(START, START + 30 * DAY, n))
+    id_user = rng.integers(0, 12, n)
+    id_qos = rng.integers(0, 3, n)
+    running_time = (600 * (id_user + 1) * (id_qos + 1) * rng.uniform(0.5, 1.5, n)).astype(np.int64)
+    time_start = time_submit + rng.integers(0, 3600, n)
+    df = pd.DataFrame({
+        'id_user': id_user, 'id_qos': id_qos, 'cpus_req': rng.integers(1, 64, n), 'nodes_alloc': rng.integers(1, 4, n),
+        'timelimit': running_time // 60 + rng.integers(10, 120, n), 'time_submit': time_submit, 'time_start': time_start,
+        'time_end': time_start + running_time, 'priority': rng.integers(1, 1000, n), 'state': np.where(rng.random(n) < 0.9, 3, 5),
+    })
+    path = str(tmp_path / 'jobs_table.csv')
+    df.to_csv(path, index=False)
+    return path
@@ -0,0 +1,18 @@
+import pandas as pd
+from conftest import DAY, START
+from features import feature_extract_train, load_jobs, train_features
+
+def test_resumed_train_features_match_a_full_replay(job_table, tmp_path):
+    jobs = load_jobs(job_table)
+    first, second = str(tmp_path / 'day10.npz'), str(tmp_path / 'day20.npz')
+    feature_extract_train(job_table, START + 10 * DAY, checkpoint_path=first)
+
+    # resumed twice, rows of jobs running at a cutoff are carried over by both checkpoints
+    resumed = feature_extract_train(job_table, START + 20 * DAY, state_path=first, checkpoint_path=second)
+    full = train_features(jobs, START + 20 * DAY, ended_since=START + 10 * DAY)
+    assert len(full) > 0
+    pd.testing.assert_frame_equal(resumed, full, check_dtype=False)
+
+    resumed = feature_extract_train(job_table, START + 28 * DAY, state_path=second)
+    full = train_features(jobs, START + 28 * DAY, ended_since=START + 20 * DAY)
+    pd.testing.assert_frame_equal(resumed, full, check_dtype=False)
@@ -0,0 +1,64 @@
+import os
+import json
+import train
+from conftest import DAY, START
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_update_in_place_keeps_the_model_until_the_retrain(job_table, tmp_path, monkeypatch):
+    folder = str(tmp_path / 'model') + '/'
+    train.train(job_table, START + 20 * DAY, folder)
+    original = read(folder + 'model.txt')
+
+    # a guard no warm start passes, the fallback must still see the original model.txt
+    seen = []
+    train_model = train.train_model
+    def retrain(df, saving_folder='./', *args, **kwargs):
+        seen.append(read(folder + 'model.txt'))
+        return train_model(df, saving_folder, *args, **kwargs)
+    monkeypatch.setattr(train, 'train_model', retrain)
+
+    info = train.update(job_table, START + 25 * DAY, folder + 'model.txt', folder, max_regression=-1.0)
+    assert seen == [original]
+    assert info['mode'] == 'full' and info['cutoff'] == START + 25 * DAY
+    assert not os.path.exists(folder + 'model.txt.tmp')
+    with open(folder + train.MODEL_INFO) as f:
+        assert json.load(f) == info
+
+def test_update_in_place_scores_the_original_model(job_table, tmp_path, monkeypatch):
+    folder = str(tmp_path / 'model') + '/'
+    train.train(job_table, START + 20 * DAY, folder)
+    original = read(folder + 'model.txt')
+
+    scored = []
+    held_out_score = train.held_out_score
+    def score(model, df):
+        scored.append(model.model_to_string())
+        return held_out_score(model, df)
+    monkeypatch.setattr(train, 'held_out_score', score)
+
+    info = train.update(job_table, START + 25 * DAY, folder + 'model.txt', folder, max_regression=1e9)
+    assert info['mode'] == 'warm'
+    # init_model is scored as it was before the update, the warm model after it
+    assert scored[0] == train.lgb.Booster(model_str=original.decode()).model_to_string()
+    assert read(folder + 'model.txt') != original
+
+def test_update_from_history_state_matches_a_full_replay(job_table, tmp_path):
+    folder = str(tmp_path / 'model') + '/'
+    state = str(tmp_path / 'history.npz')
+    train.train(job_table, START + 20 * DAY, folder, history_state=state)
+    assert train.load_history_state(state, 'train')['cutoff'] == START + 20 * DAY
+
+    replayed = str(tmp_path / 'replayed') + '/'
+    os.makedirs(replayed)
+    for name in ('model.txt', train.MODEL_INFO):
+        with open(replayed + name, 'wb') as f:
+            f.write(read(folder + name))
+
+    info = train.update(job_table, START + 25 * DAY, folder + 'model.txt', folder, max_regression=1e9, history_state=state)
+    assert info == train.update(job_table, START + 25 * DAY, replayed + 'model.txt', replayed, max_regression=1e9)
+    assert read(folder + 'model.txt') == read(replayed + 'model.txt')
+    assert train.load_history_state(state, 'train')['cutoff'] == START + 25 * DAY
+    assert not os.path.exists(state + '.tmp')
@@ -2,135 +2,542 @@ import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import *
 import lightgbm as lgb
-import heapq
+import numpy as np
 import os
 import sys
+import json
+import hashlib
+import argparse
+import itertools
+import multiprocessing
+import tempfile
+import time
+import history
+import profiling
+from features import FEATURES, LABEL, TRAIN_COLUMNS, feature_extract_train, load_jobs, jobs_history, train_features, walk_forward_features, model_input
+from history import load_history_state
+from jobtable import save_columns, load_columns
+from profiling import memory_report, stage, save_timing
 
-def feature_extract(job_table_path, test_start_time):
-    with open(job_table_path, 'r', errors='ignore') as f:
-        data = pd.read_csv(f)
+metric = 'l1'
+num_leaves = 1000
+max_depth = 20
+learning_rate = 0.1
 
-    cols = ['id_user', 'id_qos', 'cpus_req', 'nodes_alloc', 'timelimit', 'time_submit', 'time_start', 'time_end', 'state']
-    data = data[cols]
+PARAMS = {
+    'boosting_type': 'gbdt',
+    'objective': 'regression',
+    'metric': metric,
+    'num_leaves': num_leaves,
+    'learning_rate': learning_rate,
+    'max_depth': max_depth,
+    'early_stopping_rounds': 10,
+    'verbose': 2,
+    'seed': 42,
+    # LightGBM defaults, spelled out because they decide the binning
+    'max_bin': 255,
+    'min_data_in_bin': 3,
+    'bin_construct_sample_cnt': 200000,
+}
+NUM_ROUND = 1000
+EXTRA_ROUNDS = 100
+MAX_REGRESSION = 0.05
+MODEL_INFO = 'model_info.json'
+SAMPLE_SEED = 42
+PILOT_FRACTION = 0.05
 
-    data = data.loc[data['time_end'] < test_start_time]
+TEST_SIZE = 0.2
+SPLIT_SEED = 42
+GUARD_SIZE = 0.2
+BINNING_PARAMS = ['max_bin', 'min_data_in_bin', 'bin_construct_sample_cnt', 'min_data_in_leaf', 'feature_pre_filter', 'seed']
 
-    data = data.loc[data['state'] == 3]
-    data = data.drop("state", axis=1)
+def dataset_key(X, y, params=PARAMS):
+    # content hash of the feature matrix, the split and the binning parameters
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(X).view(np.uint8))
+    h.update(np.ascontiguousarray(y).view(np.uint8))
+    config = {
+        'shape': list(X.shape), 'dtype': str(X.dtype), 'label_dtype': str(y.dtype), 'features': FEATURES,
+        'test_size': TEST_SIZE, 'split_seed': SPLIT_SEED,
+        'binning': {key: params.get(key) for key in BINNING_PARAMS},
+        'lightgbm': lgb.__version__,
+    }
+    h.update(json.dumps(config, sort_keys=True).encode())
+    return h.hexdigest()
 
-    data['timelimit'] = data['timelimit'] * 60
-    data['running_time'] = data['time_end'] - data['time_start']
-    data = data[data['running_time'] <= data['timelimit'] + 60]
-    
-    data['time_submit_standard'] = pd.to_datetime(data['time_submit'], unit='s')
-
-    data['sub_year'] = data['time_submit_standard'].dt.year.astype(int)
-    data['sub_quarter'] = data['time_submit_standard'].dt.quarter.astype(int)
-    data['sub_month'] = data['time_submit_standard'].dt.month.astype(int)
-    data['sub_day'] = data['time_submit_standard'].dt.day.astype(int)
-    data['sub_hour'] = data['time_submit_standard'].dt.hour.astype(int)
-    # data['sub_minute'] = data['time_submit_standard'].dt.minute.astype(int)
-    # data['sub_second'] = data['time_submit_standard'].dt.second.astype(int)
-    data['sub_day_of_year'] = data['time_submit_standard'].dt.dayofyear.astype(int)
-    data['sub_day_of_month'] = data['time_submit_standard'].dt.day.astype(int)
-    data['sub_day_of_week'] = data['time_submit_standard'].dt.dayofweek.astype(int)
-
-    data = data.drop('time_submit_standard', axis=1)
-    data = data.sort_values(by='time_submit').reset_index(drop=True)
-
-    data['top1_time'] = 0
-    data['top2_time'] = 0
-
-    pq_running = [] # (time_end, idx), sorted by time_end
-    pq_finished = {} # group by user, (idx, running_time), sorted by idx
-    for idx, item in data.iterrows():
-        time_submit = item['time_submit']
-        while len(pq_running) > 0 and pq_running[0][0] < time_submit:
-            _, idx_ = heapq.heappop(pq_running)
-            user = data.loc[idx_]['id_user']
-            running_time = data.loc[idx_]['running_time']
-            if user not in pq_finished:
-                pq_finished[user] = []
-            heapq.heappush(pq_finished[user], (idx_, running_time))
-            if(len(pq_finished[user]) > 2):
-                heapq.heappop(pq_finished[user])
-                
-        user = item['id_user']
-        if user not in pq_finished:
-            data.at[idx, 'top1_time'] = 0
-            data.at[idx, 'top2_time'] = 0
-        elif len(pq_finished[user]) == 1:
-            data.at[idx, 'top1_time'] = pq_finished[user][0][1]
-            data.at[idx, 'top2_time'] = pq_finished[user][0][1]
-        else:
-            data.at[idx, 'top1_time'] = pq_finished[user][1][1]
-            data.at[idx, 'top2_time'] = pq_finished[user][0][1]
-        
-        heapq.heappush(pq_running, (item['time_end'], idx))
+def _split(X, y):
+    return train_test_split(X, y, test_size=TEST_SIZE, random_state=SPLIT_SEED)
 
-    data['top2_mean'] = data[['top1_time', 'top2_time']].mean(axis=1)
+def cache_datasets(df, params=PARAMS, cache_folder='./'):
+    # paths of the binned train / validation Datasets of df in cache_folder, binned and saved when missing
+    X = model_input(df)
+    y = df[LABEL].to_numpy(dtype=np.float32)
+    memory_report('train matrix', X)
 
-    data = data.drop("time_start", axis=1)
-    data = data.drop("time_end", axis=1)
+    key = dataset_key(X, y, params)
+    train_path = os.path.join(cache_folder, key + '.train.bin')
+    test_path = os.path.join(cache_folder, key + '.valid.bin')
+    if os.path.exists(train_path) and os.path.exists(test_path):
+        print(f'Reusing binned datasets {key} from {cache_folder}')
+        return train_path, test_path
 
-    return data
+    X_train, X_test, y_train, y_test = _split(X, y)
+    del X, y
+    train_data = lgb.Dataset(X_train, label=y_train, feature_name=FEATURES, params=params, free_raw_data=True)
+    test_data = lgb.Dataset(X_test, label=y_test, feature_name=FEATURES, params=params, reference=train_data, free_raw_data=True)
 
-def train_model(df, saving_folder = './'):
-    cols = ['id_user', 'id_qos', 'cpus_req', 'nodes_alloc', 'timelimit', 'time_submit', 'sub_year', 'sub_quarter', 'sub_month', 'sub_day', 'sub_hour', 'sub_day_of_year', 'sub_day_of_month', 'sub_day_of_week', 'top1_time', 'top2_time', 'top2_mean', 'running_time']
-    df = df[cols]
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    # save under temporary names first, so an interrupted run never leaves half a cache entry
+    for data, path in ((train_data, train_path), (test_data, test_path)):
+        data.save_binary(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    return train_path, test_path
 
-    df['id_qos'] = df['id_qos'].astype('int')
-    df['id_user'] = df['id_user'].astype('int')
+def load_datasets(train_path, test_path, params=PARAMS):
+    train_data = lgb.Dataset(train_path, params=params)
+    test_data = lgb.Dataset(test_path, params=params, reference=train_data)
+    return train_data, test_data
 
-    X_train, X_test, y_train, y_test = train_test_split(df.drop(['running_time'], axis=1), df['running_time'], test_size=0.2, random_state=42)
-    
-    train_data = lgb.Dataset(X_train, label=y_train,  free_raw_data=True)
-    test_data = lgb.Dataset(X_test, label=y_test,  free_raw_data=True)
+def build_datasets(df, params=PARAMS, cache_folder=None):
+    # binned train / validation Datasets, loaded from cache_folder when the same data was binned before
+    if cache_folder is not None:
+        return load_datasets(*cache_datasets(df, params, cache_folder), params)
+
+    X = model_input(df)
+    y = df[LABEL].to_numpy(dtype=np.float32)
+    memory_report('train matrix', X)
+
+    X_train, X_test, y_train, y_test = _split(X, y)
+    del X, y
+
+    train_data = lgb.Dataset(X_train, label=y_train, feature_name=FEATURES, params=params, free_raw_data=True)
+    test_data = lgb.Dataset(X_test, label=y_test, feature_name=FEATURES, params=params, reference=train_data, free_raw_data=True)
+    return train_data, test_data
+
+def train_model(df, saving_folder = './', cache_folder=None, params=PARAMS):
+    with stage('dataset'):
+        train_data, test_data = build_datasets(df, params, cache_folder)
+        # binning is lazy, construct here so that it is not counted as boosting
+        train_data.construct()
+        test_data.construct()
     
-    metric = 'l1'
-    num_leaves = 1000
-    max_depth = 20
-    learning_rate = 0.1
-
-    params = {
-        'boosting_type': 'gbdt',
-        'objective': 'regression',
-        'metric': metric,
-        'num_leaves': num_leaves,
-        'learning_rate': learning_rate,
-        'max_depth': max_depth,
-        'early_stopping_rounds': 10,
-        'verbose': 2,
-        'seed': 42
+    with stage('boosting'):
+        gbm = lgb.train(params, train_data, NUM_ROUND, valid_sets=[test_data])
+    memory_report('boosting')
+
+    with stage('save_model'):
+        if not os.path.exists(saving_folder):
+            os.makedirs(saving_folder)
+        gbm.save_model(saving_folder + 'model.txt')
+    return gbm
+
+def save_model_info(saving_folder, gbm, cutoff, rows, mode, reference=None):
+    # model_info.json next to model.txt: what a later warm start continues from. reference is the
+    # validation score of the last full retrain, warm starts are measured against it
+    score = gbm.best_score['valid_0'][metric]
+    info = {
+        'cutoff': int(cutoff), 'mode': mode, 'rows': rows, metric: score,
+        'reference_' + metric: score if reference is None else reference,
+        'best_iteration': gbm.best_iteration, 'num_trees': gbm.num_trees(),
     }
-    num_round = 1000
-    gbm = lgb.train(params, train_data, num_round, valid_sets=[test_data])
+    info_path = os.path.join(saving_folder, MODEL_INFO)
+    with open(info_path + '.tmp', 'w') as f:
+        json.dump(info, f, indent=1)
+    os.replace(info_path + '.tmp', info_path)
+    return info
+
+def load_model_info(model_path):
+    info_path = os.path.join(os.path.dirname(model_path), MODEL_INFO)
+    if not os.path.exists(info_path):
+        raise FileNotFoundError(f'{info_path} not found, warm starts need a model saved by train.py')
+    with open(info_path, 'r') as f:
+        return json.load(f)
+
+def warm_start(df, init_model, model_path, extra_rounds=EXTRA_ROUNDS, params=PARAMS):
+    # Continue boosting init_model on df for at most extra_rounds, saved to model_path. The Datasets are
+    # never cached, LightGBM needs the raw features to score them with init_model.
+    with stage('dataset'):
+        train_data, test_data = build_datasets(df, params)
+
+    with stage('boosting'):
+        gbm = lgb.train(params, train_data, extra_rounds, valid_sets=[test_data], init_model=init_model)
+    memory_report('boosting')
+
+    with stage('save_model'):
+        gbm.save_model(model_path)
+    return gbm
+
+def guard_split(df):
+    # rows left out of a warm start, neither boosted on nor used for its early stopping
+    return train_test_split(df, test_size=GUARD_SIZE, random_state=SPLIT_SEED)
+
+def held_out_score(model, df):
+    return mean_absolute_error(df[LABEL].to_numpy(dtype=np.float32), model.predict(model_input(df)))
+
+def commit_history_state(history_state):
+    # the advanced checkpoint replaces the resumed one once the model it goes with is saved
+    if history_state is not None:
+        os.replace(history_state + '.tmp', history_state)
+
+def update(job_table_path, test_start_time, init_model, saving_folder='./', cache_folder=None, extra_rounds=EXTRA_ROUNDS, max_regression=MAX_REGRESSION,
+           history_state=None):
+    # Warm start init_model on the jobs that ended since its cutoff, and retrain from scratch when the
+    # warm model scores more than max_regression (relative) worse than init_model on guard rows of those
+    # jobs. saving_folder may hold init_model: the warm model only replaces it once it passed. With an
+    # existing history_state only the jobs submitted since its cutoff are read and replayed, the state is
+    # then advanced to test_start_time.
+    info = load_model_info(init_model)
+    state = None
+    if history_state is not None and os.path.exists(history_state):
+        state = load_history_state(history_state, 'train')
+        if state['cutoff'] > info['cutoff']:
+            raise ValueError(f'{history_state} is past the cutoff of {init_model}, jobs that ended in between would be missed')
+    jobs = load_jobs(job_table_path, since=state['cutoff'] if state is not None else None)
+    history = jobs_history(jobs) if state is None else None
+
+    checkpoint_path = history_state + '.tmp' if history_state is not None else None
+    if checkpoint_path is not None:
+        df = train_features(jobs, test_start_time, state, checkpoint_path, ended_since=info['cutoff'])
+    else:
+        df = train_features(jobs, test_start_time, history=history, ended_since=info['cutoff'])
+    print(f'{len(df)} jobs ended since the cutoff of {init_model}')
+    reference = info['reference_' + metric]
+    if len(df) >= 3:
+        rows = len(df)
+        df, guard = guard_split(df)
+        baseline = held_out_score(lgb.Booster(model_file=init_model), guard)
+        if not os.path.exists(saving_folder):
+            os.makedirs(saving_folder)
+        model_path = saving_folder + 'model.txt'
+        gbm = warm_start(df, init_model, model_path + '.tmp', extra_rounds)
+        score = held_out_score(gbm, guard)
+        print(f'Warm start {metric} {score:.4f}, {init_model} {baseline:.4f} on {len(guard)} held out new jobs')
+        if score <= baseline * (1 + max_regression):
+            os.replace(model_path + '.tmp', model_path)
+            info = save_model_info(saving_folder, gbm, test_start_time, rows, 'warm', reference)
+            commit_history_state(history_state)
+            return info
+        os.remove(model_path + '.tmp')
+        print(f'Warm start {metric} {score:.4f} regressed past {baseline:.4f}, retraining from scratch')
+    else:
+        print('Too few new jobs to warm start, retraining from scratch')
+
+    if state is not None:
+        # a full retrain needs the whole table
+        jobs = load_jobs(job_table_path)
+    df = train_features(jobs, test_start_time, history=history)
+    del jobs, history
+    gbm = train_model(df, saving_folder, cache_folder)
+    info = save_model_info(saving_folder, gbm, test_start_time, len(df), 'full')
+    commit_history_state(history_state)
+    return info
+
+def strata(df):
+    # stratum of every row: id_user, id_qos and the power of two bucket of running_time
+    codes = [np.unique(df['id_user'].to_numpy(), return_inverse=True)[1].reshape(-1),
+             np.unique(df['id_qos'].to_numpy(), return_inverse=True)[1].reshape(-1),
+             np.log2(np.maximum(df[LABEL].to_numpy(dtype=np.float64), 0) + 1).astype(np.int64)]
+    stratum = np.zeros(len(df), dtype=np.int64)
+    for code in codes:
+        stratum = stratum * (int(code.max()) + 1 if len(code) > 0 else 1) + code
+    return np.unique(stratum, return_inverse=True)[1].reshape(-1)
+
+def stratified_sample(stratum, fraction, seed=SAMPLE_SEED):
+    # positions of a random fraction of every stratum (at least one row each), in their original order
+    if fraction >= 1:
+        return np.arange(len(stratum))
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(stratum)), stratum))
+    size = np.bincount(stratum)
+    first = np.cumsum(size) - size
+    rank = np.empty(len(stratum), dtype=np.int64)
+    rank[order] = np.arange(len(stratum)) - first[stratum[order]]
+    quota = np.maximum(1, np.round(fraction * size)).astype(np.int64)
+    return np.flatnonzero(rank < quota[stratum])
+
+def sample_size(size, fraction):
+    # rows stratified_sample keeps of strata of the given sizes
+    if fraction >= 1:
+        return int(size.sum())
+    return int(np.maximum(1, np.round(fraction * size)).sum())
+
+def sample_fraction(size, rows):
+    # largest fraction whose stratified sample has at most rows rows, 0 when even one row per stratum is more
+    if sample_size(size, 1.0) <= rows:
+        return 1.0
+    low, high = 0.0, 1.0
+    for _ in range(40):
+        mid = (low + high) / 2
+        if sample_size(size, mid) <= rows:
+            low = mid
+        else:
+            high = mid
+    return low
+
+class SampledTraining:
+    # Training on stratified samples of the training split, all validated on the full validation split
+    # so their scores compare. The split is the one build_datasets makes, a fraction of 1 trains the
+    # same model as train_model.
+
+    def __init__(self, df, params=PARAMS):
+        self.params = params
+        self.X = model_input(df)
+        self.y = df[LABEL].to_numpy(dtype=np.float32)
+        rows = np.arange(len(df))
+        self.train_rows, self.valid_rows = train_test_split(rows, test_size=TEST_SIZE, random_state=SPLIT_SEED)
+        self.stratum = strata(df.iloc[self.train_rows])
+
+    def fit(self, fraction):
+        rows = self.train_rows[stratified_sample(self.stratum, fraction)]
+        start = time.time()
+        train_data = lgb.Dataset(self.X[rows], label=self.y[rows], feature_name=FEATURES, params=self.params, free_raw_data=True)
+        test_data = lgb.Dataset(self.X[self.valid_rows], label=self.y[self.valid_rows], feature_name=FEATURES, params=self.params,
+                                reference=train_data, free_raw_data=True)
+        gbm = lgb.train(self.params, train_data, NUM_ROUND, valid_sets=[test_data])
+        return gbm, len(rows), time.time() - start
+
+    def budget_fraction(self, budget):
+        # Training time grows about linearly with the rows, a pilot fit on PILOT_FRACTION measures the
+        # rate and the rest of the budget decides the rows. With one row per stratum at least, the pilot
+        # is more than PILOT_FRACTION of the rows and the fraction keeping those rows is looked up in the
+        # stratum sizes. Returns the pilot too, for when the budget leaves no room for a larger sample.
+        pilot = self.fit(PILOT_FRACTION)
+        rows = pilot[1] * max(budget - pilot[2], 0) / max(pilot[2], 1e-3)
+        fraction = sample_fraction(np.bincount(self.stratum), rows)
+        print(f'Pilot on {pilot[1]} rows ({pilot[1] / len(self.train_rows):.1%} of {len(self.train_rows)}) took {pilot[2]:.1f}s, '
+              f'{budget}s budget allows {int(rows)} rows, a {fraction:.3f} sample')
+        return fraction, pilot
+
+def train_sampled(df, saving_folder='./', fraction=None, budget=None, params=PARAMS):
+    # model trained on a stratified sample of fraction of the training split, or the largest fraction
+    # that fits a wall-clock budget in seconds
+    training = SampledTraining(df, params)
+    del df
+    if fraction is None:
+        fraction, pilot = training.budget_fraction(budget)
+        gbm, rows, _ = pilot if fraction <= PILOT_FRACTION else training.fit(fraction)
+    else:
+        gbm, rows, _ = training.fit(fraction)
 
     if not os.path.exists(saving_folder):
         os.makedirs(saving_folder)
     gbm.save_model(saving_folder + 'model.txt')
+    return gbm, rows
 
-def train(job_table_path, test_start_time, saving_folder = './'):
-    df = feature_extract(job_table_path, test_start_time)
-    train_model(df, saving_folder)
+def learning_curve(df, fractions, saving_folder='./', params=PARAMS):
+    # sample rows vs validation score vs training time, in learning_curve.csv
+    training = SampledTraining(df, dict(params, verbose=-1))
+    del df
+    results = []
+    for fraction in sorted(fractions):
+        gbm, rows, wall_time = training.fit(fraction)
+        results.append({'fraction': fraction, 'rows': rows, metric: gbm.best_score['valid_0'][metric],
+                        'best_iteration': gbm.best_iteration, 'train_time': round(wall_time, 3)})
+        print(f'fraction {fraction}: {rows} rows, {metric} {results[-1][metric]:.4f}, {wall_time:.1f}s')
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2 or len(sys.argv) > 4:
-        print('Usage: python train.py job_table_path [date] [saving_folder]')
-        sys.exit(1)
+    results = pd.DataFrame(results)
+    if not os.path.exists(saving_folder):
+        os.makedirs(saving_folder)
+    results.to_csv(os.path.join(saving_folder, 'learning_curve.csv'), index=False)
+    print(results.to_string(index=False))
+    return results
+
+def split_cores(n_tasks, workers=None, cores=None):
+    # concurrent workers and LightGBM threads per worker. Boosting scales sublinearly with threads,
+    # so as many tasks as possible run side by side and the leftover cores go to their threads
+    if cores is None:
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    workers = max(1, min(workers or n_tasks, n_tasks, cores))
+    return workers, max(1, cores // workers)
+
+def process_pool(workers):
+    # spawn, not fork: a forked child of a process that already ran OpenMP (Dataset binning) can hang
+    return multiprocessing.get_context('spawn').Pool(workers)
+
+def parameter_grid(grid):
+    # {'num_leaves': [63, 255], 'learning_rate': 0.05} -> one params dict per combination
+    for key in grid:
+        if key in BINNING_PARAMS:
+            raise ValueError(f'{key} decides the binning and cannot vary across trials sharing one Dataset')
+    keys = sorted(grid)
+    values = [grid[key] if isinstance(grid[key], list) else [grid[key]] for key in keys]
+    for combination in itertools.product(*values):
+        yield dict(zip(keys, combination))
+
+def _sweep_trial(task):
+    trial, overrides, train_path, test_path, model_folder = task
+    params = dict(PARAMS, verbose=-1)
+    params.update(overrides)
+
+    start = time.time()
+    train_data, test_data = load_datasets(train_path, test_path, params)
+    gbm = lgb.train(params, train_data, NUM_ROUND, valid_sets=[test_data])
+    wall_time = time.time() - start
+
+    if not os.path.exists(model_folder):
+        os.makedirs(model_folder)
+    model_path = os.path.join(model_folder, 'model.txt')
+    gbm.save_model(model_path)
+
+    result = {'trial': trial}
+    result.update(overrides)
+    result[metric] = gbm.best_score['valid_0'][metric]
+    result['best_iteration'] = gbm.best_iteration
+    result['wall_time'] = round(wall_time, 3)
+    result['model_size'] = os.path.getsize(model_path)
+    return result
+
+def sweep(df, grid, saving_folder='./', cache_folder=None, workers=None):
+    # one trial per combination of grid, all trials train on the same binned Datasets
+    trials = list(parameter_grid(grid))
+    workers, threads = split_cores(len(trials), workers)
+    print(f'{len(trials)} trials on {workers} workers with {threads} threads each')
+
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        train_path, test_path = cache_datasets(df, PARAMS, cache_folder if cache_folder is not None else tmp_folder)
+        del df
+        tasks = []
+        for trial, overrides in enumerate(trials):
+            overrides = dict({'num_threads': threads}, **overrides)
+            tasks.append((trial, overrides, train_path, test_path, os.path.join(saving_folder, 'sweep', f'{trial:03d}')))
+
+        results = []
+        with process_pool(workers) as pool:
+            for result in pool.imap_unordered(_sweep_trial, tasks):
+                print(f'trial {result["trial"]}: {metric} {result[metric]:.4f}, best iteration {result["best_iteration"]}, {result["wall_time"]:.1f}s')
+                results.append(result)
+
+    results = pd.DataFrame(results).sort_values(by='trial').reset_index(drop=True)
+    results.to_csv(os.path.join(saving_folder, 'sweep_results.csv'), index=False)
+    print(results.sort_values(by=metric, kind='stable').to_string(index=False))
+    return results
 
-    job_table_path = sys.argv[1]
+def cutoff_folder(cutoff):
+    # 2020-11-01 for midnight cutoffs, 2020-11-01T120000 otherwise
+    cutoff = pd.Timestamp(cutoff, unit='s')
+    return cutoff.strftime('%Y-%m-%d') if cutoff == cutoff.normalize() else cutoff.strftime('%Y-%m-%dT%H%M%S')
 
-    if len(sys.argv) >= 3:
-        test_start_time = pd.to_datetime(sys.argv[2])
+def _walk_forward_cutoff(task):
+    cutoff, table_path, job_table_path, model_folder, cache_folder, threads = task
+    if table_path is not None:
+        table = load_columns(table_path)
+        df = table.loc[(table['time_end'] < cutoff).to_numpy(), TRAIN_COLUMNS].reset_index(drop=True)
+        del table
     else:
-        test_start_time = pd.Timestamp.now()
+        df = feature_extract_train(job_table_path, cutoff)
 
-    if len(sys.argv) >= 4:
-        saving_folder = sys.argv[3]
+    start = time.time()
+    gbm = train_model(df, model_folder, cache_folder, dict(PARAMS, verbose=-1, num_threads=threads))
+    save_model_info(model_folder, gbm, cutoff, len(df), 'full')
+    return {
+        'cutoff': cutoff_folder(cutoff), 'rows': len(df), metric: gbm.best_score['valid_0'][metric],
+        'best_iteration': gbm.best_iteration, 'wall_time': round(time.time() - start, 3),
+    }
+
+def walk_forward(job_table_path, cutoffs, saving_folder='./', cache_folder=None, workers=None):
+    # one model per cutoff in <saving_folder>/<date>/, the features of all cutoffs come from one scan
+    cutoffs = sorted(cutoffs)
+    workers, threads = split_cores(len(cutoffs), workers)
+    print(f'{len(cutoffs)} cutoffs on {workers} workers with {threads} threads each')
+
+    jobs = load_jobs(job_table_path)
+    table = walk_forward_features(jobs, cutoffs[-1], jobs_history(jobs))
+    del jobs
+
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        # workers memory-map the shared table instead of receiving a pickled copy each
+        table_path = None
+        if table is not None:
+            table_path = os.path.join(tmp_folder, 'features.cols')
+            save_columns(table, table_path)
+            del table
+        else:
+            print('Some jobs end before they were submitted, extracting features per cutoff')
+
+        tasks = [(cutoff, table_path, job_table_path, os.path.join(saving_folder, cutoff_folder(cutoff), ''), cache_folder, threads) for cutoff in cutoffs]
+        results = []
+        with process_pool(workers) as pool:
+            for result in pool.imap_unordered(_walk_forward_cutoff, tasks):
+                print(f'cutoff {result["cutoff"]}: {result["rows"]} rows, {metric} {result[metric]:.4f}, best iteration {result["best_iteration"]}')
+                results.append(result)
+
+    results = pd.DataFrame(results).sort_values(by='cutoff').reset_index(drop=True)
+    results.to_csv(os.path.join(saving_folder, 'walk_forward_results.csv'), index=False)
+    print(results.to_string(index=False))
+    return results
+
+def train(job_table_path, test_start_time, saving_folder = './', cache_folder=None, history_state=None):
+    # history_state saves the history at test_start_time, for warm starts of this model to resume from
+    checkpoint_path = history_state + '.tmp' if history_state is not None else None
+    df = feature_extract_train(job_table_path, test_start_time, checkpoint_path=checkpoint_path)
+    gbm = train_model(df, saving_folder, cache_folder)
+    save_model_info(saving_folder, gbm, test_start_time, len(df), 'full')
+    commit_history_state(history_state)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the running time model on jobs that ended before date')
+    parser.add_argument('job_table_path')
+    parser.add_argument('date', nargs='?', help='test start time (default: now), a comma separated list of cutoffs with --walk-forward')
+    parser.add_argument('saving_folder', nargs='?', default='./')
+    parser.add_argument('--dataset-cache', help='folder of binned datasets reused by runs on the same data')
+    parser.add_argument('--sweep', metavar='GRID', help='JSON file of parameter lists, trains one model per combination in parallel')
+    parser.add_argument('--walk-forward', action='store_true', help='train one model per cutoff in date, saved in dated subfolders')
+    parser.add_argument('--init-model', help='model.txt to warm start from, boosting only on the jobs that ended since its cutoff')
+    parser.add_argument('--history-state', metavar='STATE', help='train history checkpoint: saved at date by a full training, '
+                        'resumed from and advanced by --init-model so that only the new jobs are replayed')
+    parser.add_argument('--extra-rounds', type=int, default=EXTRA_ROUNDS, help=f'boosting rounds of a warm start (default: {EXTRA_ROUNDS})')
+    parser.add_argument('--max-regression', type=float, default=MAX_REGRESSION,
+                        help=f'relative {metric} regression of the warm start past --init-model that triggers a full retrain (default: {MAX_REGRESSION})')
+    parser.add_argument('--sample-fraction', type=float, help='train on a sample of the training split stratified by user, qos and runtime bucket')
+    parser.add_argument('--sample-budget', type=float, metavar='SECONDS', help='train on the largest stratified sample that fits the wall-clock budget')
+    parser.add_argument('--learning-curve', metavar='FRACTIONS', help='comma separated sample fractions, writes saving_folder/learning_curve.csv')
+    parser.add_argument('--workers', type=int, help='concurrent sweep trials or cutoffs (default: one per core, at most one per task)')
+    parser.add_argument('--memory-report', action='store_true', help='print per-column bytes and peak RSS of each stage')
+    parser.add_argument('--profile', action='store_true', help='record wall time, CPU time and peak RSS of each stage in saving_folder/profile_train.json')
+    parser.add_argument('--history-workers', type=int, default=1, help='processes for the user-sharded history features (default: 1)')
+    args = parser.parse_args()
+    modes = [flag for flag, value in (('--sweep', args.sweep), ('--walk-forward', args.walk_forward or None), ('--init-model', args.init_model),
+                                      ('--sample-fraction', args.sample_fraction), ('--sample-budget', args.sample_budget),
+                                      ('--learning-curve', args.learning_curve)) if value is not None]
+    if len(modes) > 1:
+        parser.error(f'{" and ".join(modes)} cannot be combined')
+    if args.history_state is not None and modes not in ([], ['--init-model']):
+        parser.error('--history-state only goes with a full training or --init-model')
+    if args.walk_forward and args.date is None:
+        parser.error('--walk-forward needs the cutoffs in date')
+
+    if args.memory_report:
+        profiling.enable()
+    if args.profile:
+        profiling.enable_timing()
+    history.set_workers(args.history_workers)
+
+    if args.walk_forward:
+        cutoffs = [(pd.to_datetime(cutoff) - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s') for cutoff in args.date.split(',')]
+        walk_forward(args.job_table_path, cutoffs, args.saving_folder, args.dataset_cache, args.workers)
     else:
-        saving_folder = './'
+        if args.date is not None:
+            test_start_time = pd.to_datetime(args.date)
+        else:
+            test_start_time = pd.Timestamp.now()
+
+        test_start_time = (test_start_time - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
 
-    test_start_time = (test_start_time - pd.to_datetime('1970-01-01')) // pd.to_timedelta('1s')
+        if args.sweep is not None:
+            with open(args.sweep) as f:
+                grid = json.load(f)
+            sweep(feature_extract_train(args.job_table_path, test_start_time), grid, args.saving_folder, args.dataset_cache, args.workers)
+        elif args.learning_curve is not None:
+            learning_curve(feature_extract_train(args.job_table_path, test_start_time), [float(f) for f in args.learning_curve.split(',')], args.saving_folder)
+        elif args.sample_fraction is not None or args.sample_budget is not None:
+            df = feature_extract_train(args.job_table_path, test_start_time)
+            gbm, rows = train_sampled(df, args.saving_folder, args.sample_fraction, args.sample_budget)
+            save_model_info(args.saving_folder, gbm, test_start_time, rows, 'sample')
+        elif args.init_model is not None:
+            update(args.job_table_path, test_start_time, args.init_model, args.saving_folder, args.dataset_cache, args.extra_rounds, args.max_regression,
+                   args.history_state)
+        else:
+            train(args.job_table_path, test_start_time, args.saving_folder, args.dataset_cache, args.history_state)
 
-    train(job_table_path, test_start_time, saving_folder)
+    save_timing(os.path.join(args.saving_folder, 'profile_train.json'), command=sys.argv)
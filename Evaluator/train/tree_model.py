@@ -0,0 +1,233 @@
+import os
+import sys
+import numpy as np
+
+CACHE_VERSION = 1
+
+# decision_type bits of a LightGBM split
+CATEGORICAL_MASK = 1
+DEFAULT_LEFT_MASK = 2
+MISSING_ZERO, MISSING_NAN = 1, 2
+ZERO_THRESHOLD = 1e-35
+
+# one record per node, padded to 16 bytes: the gathers are much slower on 13-byte records
+NODE_DTYPE = np.dtype([('threshold', 'f8'), ('feature', 'i4'), ('decision_type', 'i1')], align=True)
+
+ENGINES = ['auto', 'numpy', 'lightgbm']
+NUMPY_MAX_ROWS = 100000
+
+IDENTITY_OBJECTIVES = ['regression', 'regression_l1', 'huber', 'fair', 'quantile', 'mape']
+EXP_OBJECTIVES = ['poisson', 'gamma', 'tweedie']
+
+class TreeModel:
+    # A LightGBM model.txt as flat arrays. Nodes 0 .. S-1 are the splits of all trees and nodes S .. S+L-1
+    # their leaves, children[2 * node] / children[2 * node + 1] are the left / right child of a node, and
+    # a leaf is its own child so that walks which reached a leaf stay there. roots holds the first node of
+    # every tree. Only numerical splits and non-linear trees.
+
+    ARRAYS = ['roots', 'split_feature', 'threshold', 'decision_type', 'children', 'leaf_value']
+
+    def __init__(self, num_features, objective, roots, split_feature, threshold, decision_type, children, leaf_value, nodes=None):
+        self.num_features = num_features
+        self.objective = objective
+        self.roots = roots
+        self.split_feature = split_feature
+        self.threshold = threshold
+        self.decision_type = decision_type
+        self.children = children
+        self.leaf_value = leaf_value
+
+        # one gather per step reads a whole node; leaves read as threshold 0 on feature 0. A nodes array
+        # built before (e.g. in shared memory) is used as it is
+        if nodes is None:
+            num_splits = len(threshold)
+            nodes = np.zeros(num_splits + len(leaf_value), dtype=NODE_DTYPE)
+            nodes['threshold'][:num_splits] = threshold
+            nodes['feature'][:num_splits] = split_feature
+            nodes['decision_type'][:num_splits] = decision_type
+        self.nodes = nodes
+        # without zero / NaN missing types a NaN always reads as 0, which is done once on the input
+        self.handles_missing = bool((((decision_type >> 2) & 3) != 0).any())
+
+    @classmethod
+    def from_text(cls, text):
+        header, trees = {}, []
+        tree = None
+        for line in text.splitlines():
+            if line.startswith('Tree='):
+                tree = {}
+                trees.append(tree)
+            elif line == 'end of trees':
+                break
+            elif '=' in line:
+                key, value = line.split('=', 1)
+                (header if tree is None else tree)[key] = value
+        else:
+            # a model.txt read while it is being written
+            raise ValueError('model is truncated, no "end of trees"')
+
+        if int(header.get('num_class', 1)) != 1:
+            raise ValueError('multiclass models are not supported')
+        if 'average_output' in header:
+            raise ValueError('random forest models are not supported')
+        objective = header['objective'].split()[0]
+        if objective not in IDENTITY_OBJECTIVES + EXP_OBJECTIVES:
+            raise ValueError(f'objective {objective} is not supported')
+
+        splits, leaves = [], []
+        for i, tree in enumerate(trees):
+            if int(tree.get('num_cat', 0)) > 0 or int(tree.get('is_linear', 0)) != 0:
+                raise ValueError(f'tree {i}: categorical splits and linear trees are not supported')
+            leaves.append(np.array(tree['leaf_value'].split(), dtype=np.float64))
+            if int(tree['num_leaves']) == 1:
+                splits.append(None)
+                continue
+            split = {
+                'split_feature': np.array(tree['split_feature'].split(), dtype=np.int32),
+                'threshold': np.array(tree['threshold'].split(), dtype=np.float64),
+                'decision_type': np.array(tree['decision_type'].split(), dtype=np.int8),
+            }
+            if (split['decision_type'] & CATEGORICAL_MASK).any():
+                raise ValueError(f'tree {i}: categorical splits are not supported')
+            split['left_child'] = np.array(tree['left_child'].split(), dtype=np.int32)
+            split['right_child'] = np.array(tree['right_child'].split(), dtype=np.int32)
+            splits.append(split)
+
+        num_splits = sum(len(split['threshold']) for split in splits if split is not None)
+        num_leaves = sum(len(leaf_value) for leaf_value in leaves)
+        children = np.empty(2 * (num_splits + num_leaves), dtype=np.int32)
+        children[2 * num_splits:] = np.repeat(np.arange(num_splits, num_splits + num_leaves, dtype=np.int32), 2)
+        roots = np.empty(len(trees), dtype=np.int32)
+        node_offset, leaf_offset = 0, num_splits
+        for i, (split, leaf_value) in enumerate(zip(splits, leaves)):
+            if split is None:
+                roots[i] = leaf_offset
+            else:
+                roots[i] = node_offset
+                for side, key in enumerate(('left_child', 'right_child')):
+                    # a child >= 0 is a split of the same tree, a child < 0 is its leaf ~child
+                    child = split[key]
+                    children[2 * node_offset + side:2 * (node_offset + len(child)):2] = np.where(child >= 0, child + node_offset, ~child + leaf_offset)
+                node_offset += len(split['threshold'])
+            leaf_offset += len(leaf_value)
+
+        def concatenate(key, dtype):
+            arrays = [split[key] for split in splits if split is not None]
+            return np.concatenate(arrays) if arrays else np.zeros(0, dtype)
+
+        return cls(int(header['max_feature_idx']) + 1, objective, roots,
+                   concatenate('split_feature', np.int32), concatenate('threshold', np.float64), concatenate('decision_type', np.int8),
+                   children, np.concatenate(leaves) if leaves else np.zeros(0, np.float64))
+
+    @classmethod
+    def load(cls, model_path, cache_path=None):
+        # model.txt, through a cache of the parsed arrays when cache_path is given. The cache is rebuilt
+        # when it is missing or was made from a model file of another size or modification time
+        stat = os.stat(model_path)
+        source = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        if cache_path is not None and os.path.exists(cache_path):
+            with np.load(cache_path) as cache:
+                if int(cache['version']) == CACHE_VERSION and np.array_equal(cache['source'], source):
+                    return cls(int(cache['num_features']), str(cache['objective']), **{key: cache[key] for key in cls.ARRAYS})
+
+        with open(model_path, 'r') as f:
+            model = cls.from_text(f.read())
+        if cache_path is not None:
+            model.save(cache_path, source)
+        return model
+
+    def save(self, cache_path, source):
+        tmp_path = cache_path + '.tmp.npz'
+        np.savez(tmp_path, version=CACHE_VERSION, source=source, num_features=self.num_features, objective=self.objective,
+                 **{key: getattr(self, key) for key in self.ARRAYS})
+        os.replace(tmp_path, cache_path)
+
+    @property
+    def num_trees(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        # the arrays predict reads
+        return sum(getattr(self, key).nbytes for key in self.ARRAYS) + self.nodes.nbytes
+
+    def _go_right(self, value, node):
+        if not self.handles_missing:
+            return value > node['threshold']
+        missing_type = (node['decision_type'] >> 2) & 3
+        nan = np.isnan(value)
+        value = np.where(nan & (missing_type != MISSING_NAN), 0.0, value)
+        missing = ((missing_type == MISSING_ZERO) & (np.abs(value) <= ZERO_THRESHOLD)) | ((missing_type == MISSING_NAN) & nan)
+        return np.where(missing, (node['decision_type'] & DEFAULT_LEFT_MASK) == 0, value > node['threshold'])
+
+    def _leaves(self, X, compact_every=4):
+        # leaf node of every (row, tree), all trees of all rows step one level at a time. Walks that
+        # reached a leaf are dropped every few levels, which is cheaper than after every level
+        num_splits = len(self.threshold)
+        Xf = X.ravel()
+        node = np.tile(self.roots, len(X))
+        offset = np.repeat(np.arange(0, X.size, X.shape[1], dtype=np.int64), self.num_trees)
+        walk = np.arange(len(node))
+        current = node
+        level = 0
+        while len(current) > 0:
+            split = self.nodes[current]
+            current = self.children[2 * current + self._go_right(Xf[offset + split['feature']], split)]
+            level += 1
+            if level % compact_every == 0:
+                node[walk] = current
+                inner = current < num_splits
+                walk, current, offset = walk[inner], current[inner], offset[inner]
+        return node - num_splits
+
+    def predict_raw(self, X, block_cells=1 << 18):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.num_features:
+            raise ValueError(f'expected a matrix with {self.num_features} columns, got shape {X.shape}')
+        if not self.handles_missing:
+            X = np.where(np.isnan(X), 0.0, X)
+        out = np.zeros(len(X), dtype=np.float64)
+        if self.num_trees == 0:
+            return out
+        # rows per block so that the (rows, trees) walk arrays stay around block_cells entries
+        block = max(1, block_cells // self.num_trees)
+        for start in range(0, len(X), block):
+            leaves = self._leaves(X[start:start + block])
+            out[start:start + block] = self.leaf_value[leaves].reshape(-1, self.num_trees).sum(axis=1)
+        return out
+
+    def predict(self, X):
+        raw = self.predict_raw(X)
+        return np.exp(raw) if self.objective in EXP_OBJECTIVES else raw
+
+def load_model(model_path, cache_path=None):
+    return TreeModel.load(model_path, cache_path)
+
+def choose_engine(rows, engine='auto'):
+    # TreeModel starts in milliseconds where importing lightgbm takes ~1.5s, but walks about half as fast
+    # on one core and lightgbm uses them all: large windows are predicted with lightgbm
+    if engine not in ENGINES:
+        raise ValueError(f'unknown engine {engine}, expected one of {ENGINES}')
+    if engine == 'auto':
+        return 'numpy' if rows is not None and rows <= NUMPY_MAX_ROWS else 'lightgbm'
+    return engine
+
+def load_predictor(model_path, rows=None, engine='auto'):
+    # a TreeModel (its arrays cached next to model.txt) or a lightgbm Booster, both with predict(X)
+    if choose_engine(rows, engine) == 'numpy':
+        return load_model(model_path, cache_path_of(model_path))
+    import lightgbm as lgb
+    return lgb.Booster(model_file=model_path)
+
+def cache_path_of(model_path):
+    # model.txt -> model.npz
+    return os.path.splitext(model_path)[0] + '.npz'
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python tree_model.py model.txt ...')
+        sys.exit(1)
+
+    for model_path in sys.argv[1:]:
+        model = load_model(model_path, cache_path_of(model_path))
+        print(f'{model_path} -> {cache_path_of(model_path)} ({model.num_trees} trees, {len(model.threshold)} splits, {len(model.leaf_value)} leaves)')
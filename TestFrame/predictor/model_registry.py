@@ -0,0 +1,183 @@
+"""
+Models of the predictor server by name (a cluster or a partition). Models are loaded on first use,
+reloaded in the background when their file changes and evicted least recently used first when
+the loaded models exceed a memory cap.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Evaluator", "train")
+)
+from tree_model import TreeModel, load_model, cache_path_of
+
+# Constants
+DefaultModel = "default"  # requests without a `model` field
+
+logger = logging.getLogger("predictor")
+
+
+def file_signature(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ModelEntry:
+    """A model file and the version of it that is loaded, if any"""
+
+    def __init__(self, name: str, path: str) -> None:
+        self.name = name
+        self.path = path
+        self.model = None  # type: TreeModel
+        self.signature = None  # (size, mtime_ns) of the loaded file
+        self.failed_signature = None  # file version that failed to load, not retried
+        self.nbytes = 0
+        self.num_features = 0  # of the last loaded version
+        self.num_trees = 0
+        self.load_time = 0.0
+        self.loaded_at = 0.0
+        self.last_used = 0.0
+        self.versions = 0
+        self.requests = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "path": self.path,
+            "loaded": self.model is not None,
+            "versions": self.versions,
+            "requests": self.requests,
+            "load_time": self.load_time,
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "nbytes": self.nbytes if self.model is not None else 0,
+            "num_features": self.num_features,
+            "num_trees": self.num_trees,
+        }
+
+
+class ModelRegistry:
+    """
+    Loaded models in least recently used order. Loads run on their own thread, a new version
+    replaces the old one in the event loop between two batches: a batch keeps the model it
+    started with, the next one gets the new version. `share` turns a loaded model into the one
+    that is served (see `WorkerPool.share`), a model with a `retire` method is retired once it
+    is replaced or evicted.
+    """
+
+    def __init__(self, paths: dict[str, str], memory_cap: int, share=None) -> None:
+        self.entries = {name: ModelEntry(name, path) for name, path in paths.items()}
+        self.lru = collections.OrderedDict()  # names of the loaded models, least recent first
+        self.memory_cap = memory_cap
+        self.share = share
+        self.loading = {}  # name -> asyncio.Task
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.evictions = 0
+        self.reloads = 0
+        self.failed_reloads = 0
+
+    def read(self, path: str) -> tuple[TreeModel, tuple[int, int], float]:
+        start = time.time()
+        signature = file_signature(path)
+        model = load_model(path, cache_path_of(path))
+        if file_signature(path) != signature:
+            raise ValueError(f"{path} changed while it was loaded")
+        if self.share is not None:
+            model = self.share(model)
+        return model, signature, time.time() - start
+
+    @staticmethod
+    def retire(model) -> None:
+        if model is not None and hasattr(model, "retire"):
+            model.retire()
+
+    async def load(self, entry: ModelEntry) -> None:
+        # concurrent loads of one model wait for the same read
+        task = self.loading.get(entry.name)
+        if task is None:
+            task = asyncio.create_task(self.swap(entry))
+            self.loading[entry.name] = task
+            task.add_done_callback(lambda _: self.loading.pop(entry.name, None))
+        await asyncio.shield(task)
+
+    async def swap(self, entry: ModelEntry) -> None:
+        loop = asyncio.get_running_loop()
+        model, signature, load_time = await loop.run_in_executor(self.executor, self.read, entry.path)
+        previous = entry.model
+        entry.model, entry.signature, entry.failed_signature = model, signature, None
+        self.retire(previous)
+        entry.nbytes = model.nbytes
+        entry.num_features, entry.num_trees = model.num_features, model.num_trees
+        entry.load_time = load_time
+        entry.loaded_at = time.time()
+        entry.versions += 1
+        self.lru[entry.name] = True
+        self.lru.move_to_end(entry.name)
+        logger.info(
+            f"Loaded model {entry.name} from {entry.path} in {load_time:.3f}s, "
+            f"{model.num_trees} trees, {entry.nbytes / (1 << 20):.1f} MiB"
+        )
+        self.evict(keep=entry.name)
+
+    def evict(self, keep: str) -> None:
+        while self.memory() > self.memory_cap and len(self.lru) > 1:
+            name = next(iter(self.lru))
+            if name == keep:
+                self.lru.move_to_end(name)
+                continue
+            del self.lru[name]
+            entry = self.entries[name]
+            self.retire(entry.model)
+            entry.model, entry.signature = None, None
+            self.evictions += 1
+            logger.info(f"Evicted model {name}, idle for {time.time() - entry.last_used:.0f}s")
+
+    def memory(self) -> int:
+        return sum(self.entries[name].nbytes for name in self.lru)
+
+    async def get(self, name: str) -> TreeModel:
+        entry = self.entries.get(name)
+        if entry is None:
+            raise KeyError(f"unknown model {name!r}, expected one of {sorted(self.entries)}")
+        # another load may evict it again before this resumes, under a cap of less than two models
+        while entry.model is None:
+            await self.load(entry)
+        entry.last_used = time.time()
+        self.lru.move_to_end(name)
+        return entry.model
+
+    async def watch(self, interval: float) -> None:
+        """Reloads loaded models whose file changed, a version that fails to load is skipped"""
+        while True:
+            await asyncio.sleep(interval)
+            for entry in list(self.entries.values()):
+                if entry.model is None or entry.name in self.loading:
+                    continue
+                try:
+                    signature = file_signature(entry.path)
+                except FileNotFoundError:
+                    continue
+                if signature in (entry.signature, entry.failed_signature):
+                    continue
+                try:
+                    await self.load(entry)
+                    self.reloads += 1
+                except Exception as e:
+                    entry.failed_signature = signature
+                    self.failed_reloads += 1
+                    logger.warning(f"Keeping the loaded version of model {entry.name}: {e}")
+
+    def to_dict(self) -> dict:
+        return {
+            "memory": self.memory(),
+            "memory_cap": self.memory_cap,
+            "evictions": self.evictions,
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "models": {name: entry.to_dict() for name, entry in self.entries.items()},
+        }
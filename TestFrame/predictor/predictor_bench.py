@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""
+Open-loop load generator for the predictor server.
+Feature rows of a data_loader style job window (or synthetic ones) are sent at a fixed rate,
+or in bursts like `testcase/*/stress.sh`, whether or not earlier requests were answered. Latency
+is measured from the time a request was due, so a stalled server cannot hide its queueing delay.
+Throughput, p50/p95/p99/p999 latency and errors of every rate are reported as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import subprocess
+import collections
+import numpy as np
+
+from predictor_client import PredictorClient
+from predictor_server import ConfigPath, PredictorConfig
+
+# Constants
+ServerScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), "predictor_server.py")
+Percentiles = [50, 95, 99, 99.9]
+
+
+class LocalServer:
+    """`predictor_server.py` on localhost in a subprocess, a stand-in for the cluster's predictor"""
+
+    def __init__(self, args, port: int) -> None:
+        self.port = port
+        self.command = [sys.executable, ServerScript, "-c", args.conf, "-p", str(port), "--state", ""]
+        if args.model:
+            self.command += ["-m", args.model]
+        if args.max_batch_size:
+            self.command += ["--max-batch-size", str(args.max_batch_size)]
+        if args.max_wait_ms is not None:
+            self.command += ["--max-wait-ms", str(args.max_wait_ms)]
+        if args.workers is not None:
+            self.command += ["--workers", str(args.workers)]
+        self.process = None  # type: subprocess.Popen
+
+    def start(self, timeout: float = 60.0) -> None:
+        self.process = subprocess.Popen(self.command)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Local server exited with {self.process.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"Local server did not listen on port {self.port} in {timeout}s")
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class LoadResult:
+    """Outcome of the requests sent at one rate"""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.latencies = []  # seconds, from the time a request was due
+        self.errors = collections.Counter()
+        self.timeouts = 0
+        self.sent = 0
+        self.max_lag = 0.0  # how far behind schedule the generator sent a request
+        self.elapsed = 0.0
+
+    def to_dict(self) -> dict:
+        latency = np.array(self.latencies) * 1000
+        result = {
+            "target_rate": self.rate,
+            "sent": self.sent,
+            "completed": len(self.latencies),
+            "errors": sum(self.errors.values()),
+            "timeouts": self.timeouts,
+            "elapsed": self.elapsed,
+            "throughput": len(self.latencies) / self.elapsed if self.elapsed > 0 else 0.0,
+            "max_send_lag_ms": self.max_lag * 1000,
+        }
+        if len(latency) > 0:
+            for p, value in zip(Percentiles, np.percentile(latency, Percentiles)):
+                result[f"p{p:g}".replace(".", "")] = value
+            result["mean"] = float(latency.mean())
+            result["max"] = float(latency.max())
+        if self.errors:
+            result["error_messages"] = dict(self.errors.most_common(5))
+        return result
+
+
+def job_window(args) -> list[list[float]]:
+    """Feature rows of the jobs submitted in [start, end), like `data_loader.py` builds them"""
+    from features import load_jobs, predict_features, model_input
+
+    def timestamp(value: str) -> int:
+        return int(np.datetime64(value, "s").astype(np.int64))
+
+    start, end = timestamp(args.start), timestamp(args.end)
+    df = predict_features(load_jobs(args.jobs_table, before=end), end)
+    df = df[df["time_submit"] >= start]
+    if len(df) == 0:
+        raise ValueError(f"No jobs submitted in [{args.start}, {args.end})")
+    return model_input(df).astype(np.float64).tolist()
+
+
+def synthetic_rows(num_features: int, n: int, seed: int) -> list[list[float]]:
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0, 1e4, size=(n, num_features)).tolist()
+
+
+def schedule(rate: float, duration: float, burst: int, poisson: bool, seed: int) -> np.ndarray:
+    """Times (seconds from the start) at which requests are due"""
+    n = int(rate * duration)
+    if burst > 0:
+        # `burst` requests at once, every burst / rate seconds
+        return (np.arange(n) // burst) * (burst / rate)
+    if poisson:
+        rng = np.random.default_rng(seed)
+        return np.cumsum(rng.exponential(1 / rate, size=n))
+    return np.arange(n) / rate
+
+
+async def send(client: PredictorClient, row: list[float], due: float, timeout: float, result: LoadResult) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.wait_for(client.predict(row), timeout)
+        result.latencies.append(loop.time() - due)
+    except asyncio.TimeoutError:
+        result.timeouts += 1
+    except Exception as e:
+        result.errors[str(e)] += 1
+
+
+async def open_loop(clients: list[PredictorClient], rows: list, rate: float, args) -> LoadResult:
+    loop = asyncio.get_running_loop()
+    result = LoadResult(rate)
+    due = schedule(rate, args.duration, args.burst, args.poisson, args.seed)
+    tasks = []
+    start = loop.time()
+    for idx, offset in enumerate(due.tolist()):
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        result.max_lag = max(result.max_lag, -delay)
+        client = clients[idx % len(clients)]
+        row = rows[idx % len(rows)]
+        tasks.append(asyncio.create_task(send(client, row, start + offset, args.timeout, result)))
+        result.sent += 1
+    await asyncio.gather(*tasks)
+    result.elapsed = loop.time() - start
+    return result
+
+
+async def run(args, host: str, port: int) -> dict:
+    clients = []
+    for _ in range(args.connections):
+        client = PredictorClient()
+        await client.connect(host, port)
+        clients.append(client)
+
+    server = await clients[0].stats()
+    if args.jobs_table:
+        rows = job_window(args)
+    else:
+        rows = synthetic_rows(server["model"]["num_features"], args.synthetic, args.seed)
+
+    report = {
+        "server": f"{host}:{port}",
+        "source": args.jobs_table or "synthetic",
+        "rows": len(rows),
+        "connections": args.connections,
+        "duration": args.duration,
+        "burst": args.burst,
+        "poisson": args.poisson,
+        "stages": [],
+    }
+    for rate in args.rates:
+        result = (await open_loop(clients, rows, rate, args)).to_dict()
+        report["stages"].append(result)
+        print(
+            f"rate {rate:g}/s: {result['throughput']:.0f} req/s, "
+            f"p50 {result.get('p50', 0):.2f}ms p99 {result.get('p99', 0):.2f}ms p999 {result.get('p999', 0):.2f}ms, "
+            f"{result['errors']} errors, {result['timeouts']} timeouts",
+            file=sys.stderr,
+        )
+
+    # batch sizes and server side latency over the whole run
+    server = await clients[0].stats()
+    report["server_stats"] = {
+        key: server[key] for key in ("requests", "errors", "latency_ms", "batch_size", "pool") if key in server
+    }
+    for client in clients:
+        await client.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open-loop benchmark of the predictor server")
+    parser.add_argument(
+        "-c",
+        "--conf",
+        type=str,
+        default=ConfigPath,
+        help="predictor configuration in YAML format, for the port and the model",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, help="server port, overrides PredListenPort")
+    parser.add_argument(
+        "--rates",
+        type=lambda value: [float(rate) for rate in value.split(",")],
+        default=[1000.0],
+        help="comma separated request rates (req/s), one stage each",
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per rate")
+    parser.add_argument(
+        "--burst",
+        type=int,
+        default=0,
+        help="send requests in bursts of this size, e.g. 10000 for stress.sh",
+    )
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times")
+    parser.add_argument("--connections", type=int, default=4, help="connections to spread requests over")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds before a request counts as timed out")
+    parser.add_argument("--jobs-table", type=str, help="replay the jobs of a jobs_table.csv window")
+    parser.add_argument("--start", type=str, help="window start, e.g. 2020-12-20")
+    parser.add_argument("--end", type=str, help="window end")
+    parser.add_argument("--synthetic", type=int, default=10000, help="random rows without --jobs-table")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--local", action="store_true", help="start predictor_server.py on localhost")
+    parser.add_argument("-m", "--model", type=str, help="model.txt of the local server, overrides PredModelPath")
+    parser.add_argument("--max-batch-size", type=int, help="PredMaxBatchSize of the local server")
+    parser.add_argument("--max-wait-ms", type=float, help="PredMaxWaitMs of the local server")
+    parser.add_argument("--workers", type=int, help="PredWorkers of the local server")
+    parser.add_argument("-o", "--output", type=str, help="also write the JSON report to this file")
+    parser.set_defaults(state=None)
+
+    args = parser.parse_args()
+    if args.jobs_table and not (args.start and args.end):
+        parser.error("--jobs-table needs --start and --end")
+
+    Config = PredictorConfig(args)
+    Server = LocalServer(args, Config.listen_port) if args.local else None
+    if Server is not None:
+        Server.start()
+    try:
+        Report = asyncio.run(run(args, args.host, Config.listen_port))
+    finally:
+        if Server is not None:
+            Server.stop()
+
+    print(json.dumps(Report, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(Report, file, indent=2)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+Client of `predictor_server.py`.
+Sends concurrent single-job requests with random features over one connection and prints
+the server's latency and batch size histograms.
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+
+
+class PredictorClient:
+    """Requests multiplexed over one connection, replies are matched by `id`"""
+
+    def __init__(self) -> None:
+        self.reader = None  # type: asyncio.StreamReader
+        self.writer = None  # type: asyncio.StreamWriter
+        self.waiting = {}  # id -> future
+        self.next_id = 0
+        self.receiver = None  # type: asyncio.Task
+        self.draining = asyncio.Lock()  # one drain() at a time, concurrent drains fail on Python 3.9
+
+    async def connect(self, host: str, port: int) -> None:
+        self.reader, self.writer = await asyncio.open_connection(host, port, limit=16 << 20)
+        self.receiver = asyncio.create_task(self.receive())
+
+    async def receive(self) -> None:
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            future = self.waiting.pop(reply.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError("connection closed by server"))
+        self.waiting.clear()
+
+    async def request(self, body: dict) -> dict:
+        self.next_id += 1
+        body["id"] = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.next_id] = future
+        self.writer.write((json.dumps(body) + "\n").encode())
+        async with self.draining:
+            await self.writer.drain()
+        reply = await future
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply
+
+    async def predict(self, features: list[float]) -> float:
+        return (await self.request({"features": features}))["time_pred"]
+
+    async def predict_many(self, instances: list[list[float]]) -> list[float]:
+        return (await self.request({"instances": instances}))["time_pred"]
+
+    async def stats(self) -> dict:
+        return (await self.request({"op": "stats"}))["stats"]
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        if self.receiver is not None:
+            await self.receiver
+
+
+async def run(args) -> None:
+    client = PredictorClient()
+    await client.connect(args.host, args.port)
+    num_features = (await client.stats())["model"]["num_features"]
+
+    sent = 0
+    start = time.time()
+    while sent < args.requests:
+        # `concurrency` requests in flight, coalesced by the server
+        burst = min(args.concurrency, args.requests - sent)
+        await asyncio.gather(
+            *[
+                client.predict([random.uniform(0, 1e4) for _ in range(num_features)])
+                for _ in range(burst)
+            ]
+        )
+        sent += burst
+    elapsed = time.time() - start
+
+    stats = await client.stats()
+    await client.close()
+    print(f"{sent} requests in {elapsed:.2f}s ({sent / elapsed:.0f} req/s)")
+    for name in ("latency_ms", "batch_size"):
+        hist = stats[name]
+        print(
+            f"{name}: p50 {hist['p50']:g}, p99 {hist['p99']:g}, "
+            f"mean {hist['mean']:.3f}, max {hist['max']:g}"
+        )
+        print(f"  buckets: {hist['buckets']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test client of the predictor server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=50051)
+    parser.add_argument("-n", "--requests", type=int, default=10000, help="requests to send")
+    parser.add_argument(
+        "--concurrency", type=int, default=1000, help="requests in flight at once"
+    )
+
+    args = parser.parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+
+"""
+Predictor server for the CraneSched Predictor Module.
+Serves running time predictions of a `train.py` model over TCP, one JSON object per line:
+    {"id": 1, "features": [...], "model": "c1"} -> {"id": 1, "time_pred": 123.4}
+    {"id": 2, "instances": [[...], [...]]}   -> {"id": 2, "time_pred": [123.4, 56.7]}
+    {"id": 3, "job": {"job_id": 7, "id_user": 1, ...}}   -> {"id": 3, "time_pred": 123.4}
+    {"id": 4, "op": "finish", "job_id": 7, "time_end": ..., "running_time": ...} -> {"id": 4, "ok": true}
+    {"id": 5, "op": "snapshot"}              -> {"id": 5, "ok": true}
+    {"id": 6, "op": "stats"}                 -> {"id": 6, "stats": {...}}
+Concurrent requests are coalesced into micro-batches, each predicted by a single vectorized call.
+A `job` is a submitted job, its `top1_time` / `top2_time` come from the online per-user history,
+which is updated by `finish` events and snapshot to `PredStatePath`.
+Predicting requests go to the model of their `model` field (a cluster or partition of `PredModels`),
+or to `PredModelPath`; models are reloaded when their file changes. With `PredWorkers` > 0 batches
+are predicted by a pool of worker processes that map the models from shared memory.
+"""
+
+import os
+import sys
+import json
+import yaml
+import time
+import bisect
+import signal
+import asyncio
+import logging
+import argparse
+import collections
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Evaluator", "train")
+)
+from features import FEATURES
+from datefeat import calendar_features
+from online_history import OnlineHistory
+from model_registry import DefaultModel, ModelRegistry
+from worker_pool import WorkerPool
+
+# Constants
+ConfigPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "predictor.yaml")
+StreamLimit = 16 << 20  # longest request line, in bytes
+JobFields = FEATURES[:6]  # fields of a `job` request, timelimit in seconds
+
+logger = logging.getLogger("predictor")
+
+
+class PredictorConfig:
+    """Predictor configuration, read from `predictor.yaml`"""
+
+    def __init__(self, args) -> None:
+        self.debug_level = "info"
+        self.listen_addr = "0.0.0.0"
+        self.listen_port = 50051
+        self.model_path = "model.txt"
+        self.max_batch_size = 1024
+        self.max_wait_ms = 2.0
+        self.models = {}  # name -> model.txt, besides PredModelPath
+        self.model_memory_mb = 1024.0
+        self.reload_interval = 10.0
+        self.workers = 0  # predict in the server process
+        self.state_path = ""
+        self.snapshot_interval = 60.0
+
+        try:
+            with open(args.conf.strip(), "r") as file:
+                config = yaml.safe_load(file) or {}  # type: dict
+            self.debug_level = config.get("PredDebugLevel", self.debug_level)
+            self.listen_addr = config.get("PredListenAddr", self.listen_addr)
+            self.listen_port = int(config.get("PredListenPort", self.listen_port))
+            self.model_path = config.get("PredModelPath", self.model_path)
+            self.max_batch_size = int(config.get("PredMaxBatchSize", self.max_batch_size))
+            self.max_wait_ms = float(config.get("PredMaxWaitMs", self.max_wait_ms))
+            self.models = dict(config.get("PredModels") or {})
+            self.model_memory_mb = float(config.get("PredModelMemoryMB", self.model_memory_mb))
+            self.reload_interval = float(config.get("PredReloadInterval", self.reload_interval))
+            self.workers = int(config.get("PredWorkers", self.workers))
+            self.state_path = config.get("PredStatePath", self.state_path) or ""
+            self.snapshot_interval = float(
+                config.get("PredSnapshotInterval", self.snapshot_interval)
+            )
+        except (FileNotFoundError, TypeError, ValueError, AttributeError):
+            print("Invalid config file, ignore and fall back to defaults")
+
+        # CLI overrides the config file
+        if args.port:
+            self.listen_port = args.port
+        if args.model:
+            self.model_path = args.model
+        if args.max_batch_size:
+            self.max_batch_size = args.max_batch_size
+        if args.max_wait_ms is not None:
+            self.max_wait_ms = args.max_wait_ms
+        if args.state is not None:
+            self.state_path = args.state
+        if args.workers is not None:
+            self.workers = args.workers
+
+    def __str__(self) -> str:
+        return (
+            f"PredictorConfig(addr={self.listen_addr}, port={self.listen_port}, "
+            f"model={self.model_path}, max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait_ms}, models={sorted(self.models)}, workers={self.workers}, "
+            f"state={self.state_path})"
+        )
+
+    def model_paths(self) -> dict[str, str]:
+        return {DefaultModel: self.model_path, **self.models}
+
+
+class Histogram:
+    """Counts of values in fixed buckets, quantiles are read off the bucket upper bounds"""
+
+    def __init__(self, bounds: list[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        rank, seen = q * self.count, 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if count > 0 and seen >= rank:
+                return min(self.bounds[idx], self.max) if idx < len(self.bounds) else self.max
+        return 0.0
+
+    def to_dict(self) -> dict:
+        buckets = {}
+        for idx, count in enumerate(self.counts):
+            if count > 0:
+                le = f"{self.bounds[idx]:g}" if idx < len(self.bounds) else "+Inf"
+                buckets[le] = count
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets": buckets,
+        }
+
+
+class Metrics:
+    """Request latency (ms) and batch size histograms of the server"""
+
+    def __init__(self) -> None:
+        # 2^(1/4) apart from 10us to ~100s, within 19% of any latency
+        self.latency_ms = Histogram([0.01 * 2 ** (i / 4) for i in range(94)])
+        self.batch_size = Histogram([float(2**i) for i in range(21)])
+        self.requests = 0
+        self.errors = 0
+        self.started = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "uptime": time.time() - self.started,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ms": self.latency_ms.to_dict(),
+            "batch_size": self.batch_size.to_dict(),
+        }
+
+    def summary(self) -> str:
+        latency, batch = self.latency_ms, self.batch_size
+        return (
+            f"{self.requests} requests, {self.errors} errors, "
+            f"latency p50 {latency.quantile(0.5):.3f}ms p99 {latency.quantile(0.99):.3f}ms, "
+            f"{batch.count} batches of {batch.total / max(batch.count, 1):.1f} rows on average"
+        )
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests into batches of at most `max_batch_size` rows. A batch is
+    predicted once it is full or its oldest request waited `max_wait` seconds; requests that
+    arrive while `concurrency` batches are being predicted are collected into the next one. Every
+    batch is predicted by the model `resolve` returns when it starts.
+    """
+
+    def __init__(
+        self,
+        resolve,
+        max_batch_size: int,
+        max_wait: float,
+        metrics: Metrics,
+        executor: ThreadPoolExecutor,
+        concurrency: int = 1,
+    ) -> None:
+        self.resolve = resolve
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = metrics
+        self.pending = collections.deque()  # (rows, future, arrival)
+        self.pending_rows = 0
+        self.wakeup = asyncio.Event()
+        self.full = asyncio.Event()
+        self.executor = executor
+        self.slots = asyncio.Semaphore(concurrency)
+
+    def submit(self, rows: np.ndarray) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((rows, future, loop.time()))
+        self.pending_rows += len(rows)
+        self.wakeup.set()
+        if self.pending_rows >= self.max_batch_size:
+            self.full.set()
+        return future
+
+    def take(self) -> list:
+        batch, size = [], 0
+        while self.pending and (not batch or size + len(self.pending[0][0]) <= self.max_batch_size):
+            rows, future, _ = self.pending.popleft()
+            self.pending_rows -= len(rows)
+            size += len(rows)
+            if not future.cancelled():
+                batch.append((rows, future))
+        if not self.pending:
+            self.wakeup.clear()
+        if self.pending_rows < self.max_batch_size:
+            self.full.clear()
+        return batch
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        tasks = set()
+        while True:
+            await self.wakeup.wait()
+            await self.slots.acquire()
+            timeout = self.pending[0][2] + self.max_wait - loop.time()
+            if not self.full.is_set() and timeout > 0:
+                try:
+                    await asyncio.wait_for(self.full.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self.take()
+            if not batch:
+                self.slots.release()
+                continue
+            task = asyncio.create_task(self.predict(batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def predict(self, batch: list) -> None:
+        loop = asyncio.get_running_loop()
+        X = np.concatenate([rows for rows, _ in batch])
+        try:
+            model = await self.resolve()
+            # a model in shared memory stays mapped until the batch is done, even if it is
+            # replaced or evicted before a worker picks the batch up
+            shared = hasattr(model, "acquire")
+            if shared:
+                model.acquire()
+            try:
+                y = await loop.run_in_executor(self.executor, model.predict, X)
+            finally:
+                if shared:
+                    model.release()
+        except Exception as e:
+            logger.error(f"Predict failed on a batch of {len(X)} rows: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.slots.release()
+
+        self.metrics.batch_size.record(len(X))
+        offset = 0
+        for rows, future in batch:
+            if not future.done():
+                future.set_result(y[offset : offset + len(rows)])
+            offset += len(rows)
+
+
+class PredictorServer:
+    """Reads requests off TCP connections and answers them through a `MicroBatcher` per model"""
+
+    def __init__(self, config: PredictorConfig, pool: WorkerPool = None) -> None:
+        self.config = config
+        self.metrics = Metrics()
+        self.pool = pool
+        self.registry = ModelRegistry(
+            config.model_paths(),
+            int(config.model_memory_mb * (1 << 20)),
+            share=pool.share if pool is not None else None,
+        )
+        self.batchers = {}  # model name -> MicroBatcher
+        self.tasks = []
+        # off the event loop so that requests keep being read meanwhile: one predict at a time in
+        # the server process, or one thread waiting on each worker of the pool
+        self.concurrency = pool.num_workers if pool is not None else 1
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.history = OnlineHistory()
+        if config.state_path and os.path.exists(config.state_path):
+            self.history = OnlineHistory.load(config.state_path)
+            logger.info(f"History restored from {config.state_path}, cutoff {self.history.cutoff}")
+
+    def job_row(self, job: dict, model) -> np.ndarray:
+        """Feature row of a job at its submission, the history features from the online history"""
+        if model.num_features != len(FEATURES):
+            raise ValueError(f"the model does not take the {len(FEATURES)} train.py features")
+        missing = [key for key in JobFields if key not in job]
+        if missing:
+            raise ValueError(f"job is missing {missing}")
+        values = {key: float(job[key]) for key in JobFields}
+        time_submit = int(job["time_submit"])
+        for col, value in calendar_features([time_submit]).items():
+            values[col] = float(value[0])
+        top1, top2 = self.history.submit(job.get("job_id"), int(job["id_user"]), time_submit)
+        values["top1_time"], values["top2_time"] = top1, top2
+        values["top2_mean"] = (top1 + top2) / 2
+        return np.array([[values[col] for col in FEATURES]], dtype=np.float64)
+
+    def finish(self, request: dict) -> bool:
+        """A job completion event, jobs that did not complete (`completed`: false) are dropped"""
+        return self.history.finish(
+            request["job_id"],
+            int(request["time_end"]),
+            int(request["running_time"]),
+            bool(request.get("completed", True)),
+        )
+
+    def snapshot(self) -> None:
+        if self.config.state_path:
+            self.history.save(self.config.state_path)
+            logger.debug(f"History saved to {self.config.state_path}")
+
+    def parse(self, request: dict, model) -> tuple[np.ndarray, bool]:
+        """Feature rows of a request and whether it asked for a single prediction"""
+        if "job" in request:
+            return self.job_row(request["job"], model), True
+        single = "features" in request
+        rows = request["features"] if single else request.get("instances")
+        if rows is None:
+            raise ValueError("expected `features` or `instances`")
+        # null features are missing values
+        X = np.array(rows if not single else [rows], dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != model.num_features:
+            raise ValueError(f"expected rows of {model.num_features} features")
+        return X, single
+
+    def batcher(self, name: str) -> MicroBatcher:
+        if name not in self.batchers:
+            self.batchers[name] = MicroBatcher(
+                lambda: self.registry.get(name),
+                self.config.max_batch_size,
+                self.config.max_wait_ms / 1000,
+                self.metrics,
+                self.executor,
+                self.concurrency,
+            )
+            self.tasks.append(asyncio.create_task(self.batchers[name].run()))
+        return self.batchers[name]
+
+    async def respond(self, line: bytes, arrival: float, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        request = {}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+            if request.get("op") == "stats":
+                reply = {"id": request.get("id"), "stats": self.stats()}
+            elif request.get("op") == "finish":
+                reply = {"id": request.get("id"), "ok": self.finish(request)}
+            elif request.get("op") == "snapshot":
+                if not self.config.state_path:
+                    raise ValueError("no PredStatePath configured")
+                self.snapshot()
+                reply = {"id": request.get("id"), "ok": True}
+            else:
+                name = str(request.get("model", DefaultModel))
+                X, single = self.parse(request, await self.registry.get(name))
+                self.registry.entries[name].requests += 1
+                y = await self.batcher(name).submit(X)
+                reply = {"id": request.get("id"), "time_pred": float(y[0]) if single else y.tolist()}
+                self.metrics.requests += 1
+                self.metrics.latency_ms.record((loop.time() - arrival) * 1000)
+        except Exception as e:
+            self.metrics.errors += 1
+            reply = {"id": request.get("id") if isinstance(request, dict) else None, "error": str(e)}
+
+        if not writer.is_closing():
+            writer.write((json.dumps(reply) + "\n").encode())
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info("peername")
+        logger.debug(f"Connection from {peer}")
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self.respond(line, loop.time(), writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            # ValueError: a line over StreamLimit
+            logger.warning(f"Connection from {peer} dropped: {e}")
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+        logger.debug(f"Connection from {peer} closed")
+
+    def stats(self) -> dict:
+        stats = self.metrics.to_dict()
+        stats["model"] = self.registry.entries[DefaultModel].to_dict()
+        stats["registry"] = self.registry.to_dict()
+        if self.pool is not None:
+            stats["pool"] = self.pool.to_dict()
+        stats["history"] = {
+            "cutoff": self.history.cutoff,
+            "seen": self.history.seen,
+            "users": len(self.history.finished),
+            "pending": len(self.history.pending),
+            "running": len(self.history.running),
+            "late": self.history.late,
+        }
+        stats["max_batch_size"] = self.config.max_batch_size
+        stats["max_wait_ms"] = self.config.max_wait_ms
+        return stats
+
+    def save_stats(self, path: str) -> None:
+        with open(path + ".tmp", "w") as file:
+            json.dump(self.stats(), file, indent=2)
+        os.replace(path + ".tmp", path)
+
+    async def report(self, interval: float, stats_path: str) -> None:
+        reported = 0
+        while True:
+            await asyncio.sleep(interval)
+            if self.metrics.requests + self.metrics.errors == reported:
+                continue
+            reported = self.metrics.requests + self.metrics.errors
+            logger.info(self.metrics.summary())
+            if stats_path:
+                self.save_stats(stats_path)
+
+    async def snapshots(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.snapshot()
+
+    async def serve(self, interval: float = 10.0, stats_path: str = "") -> None:
+        # the default model is loaded up front, a bad PredModelPath fails at start
+        await self.registry.get(DefaultModel)
+        self.tasks.append(asyncio.create_task(self.report(interval, stats_path)))
+        self.tasks.append(asyncio.create_task(self.snapshots(self.config.snapshot_interval)))
+        if self.config.reload_interval > 0:
+            self.tasks.append(asyncio.create_task(self.registry.watch(self.config.reload_interval)))
+        server = await asyncio.start_server(
+            self.handle, self.config.listen_addr, self.config.listen_port, limit=StreamLimit
+        )
+        logger.info(f"Serving {self.config}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        async with server:
+            await stop.wait()
+
+        for task in self.tasks:
+            task.cancel()
+        self.snapshot()
+        logger.info(self.metrics.summary())
+        if stats_path:
+            self.save_stats(stats_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching predictor server")
+    parser.add_argument(
+        "-c",
+        "--conf",
+        type=str,
+        default=ConfigPath,
+        help="predictor configuration in YAML format",
+    )
+    parser.add_argument("-p", "--port", type=int, help="listen port, overrides PredListenPort")
+    parser.add_argument("-m", "--model", type=str, help="model.txt, overrides PredModelPath")
+    parser.add_argument(
+        "--max-batch-size", type=int, help="rows per predict call, overrides PredMaxBatchSize"
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        help="longest wait for a batch to fill, overrides PredMaxWaitMs",
+    )
+    parser.add_argument(
+        "--state", type=str, help="history snapshot to restore and save, overrides PredStatePath"
+    )
+    parser.add_argument(
+        "--workers", type=int, help="predictor worker processes, 0 for none, overrides PredWorkers"
+    )
+    parser.add_argument(
+        "--stats-interval", type=float, default=10.0, help="seconds between stats logs"
+    )
+    parser.add_argument(
+        "--stats-path", type=str, default="", help="also write the stats to this JSON file"
+    )
+
+    args = parser.parse_args()
+    Config = PredictorConfig(args)
+    logging.basicConfig(
+        level=getattr(logging, str(Config.debug_level).upper(), logging.INFO),
+        format="[%(asctime)s] [%(levelname)s] %(message)s",
+    )
+
+    # workers are started before the event loop and its threads
+    Pool = WorkerPool(Config.workers) if Config.workers > 0 else None
+    if Pool is not None:
+        Pool.start()
+    try:
+        Server = PredictorServer(Config, Pool)
+        asyncio.run(Server.serve(args.stats_interval, args.stats_path))
+    finally:
+        if Pool is not None:
+            Pool.close()
@@ -0,0 +1,247 @@
+"""
+Predictor worker pool. The parsed tree arrays of every model are copied once into a shared memory
+segment, worker processes map them from there instead of loading their own copy, so adding
+workers adds CPU but hardly any memory. The server hands batches to idle workers over pipes.
+"""
+
+import os
+import sys
+import queue
+import logging
+import threading
+import collections
+import multiprocessing
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Evaluator", "train")
+)
+from tree_model import TreeModel
+
+# Constants
+SharedArrays = TreeModel.ARRAYS + ["nodes"]
+Alignment = 64
+
+logger = logging.getLogger("predictor")
+
+
+def share_model(model: TreeModel) -> tuple[SharedMemory, dict]:
+    """Copies the arrays of a model into a new shared memory segment"""
+    arrays, offset = {}, 0
+    for key in SharedArrays:
+        array = getattr(model, key)
+        offset = (offset + Alignment - 1) // Alignment * Alignment
+        arrays[key] = (offset, array.dtype, array.shape)
+        offset += array.nbytes
+    shm = SharedMemory(create=True, size=max(offset, 1))
+    for key, (offset, dtype, shape) in arrays.items():
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = getattr(model, key)
+    layout = {"num_features": model.num_features, "objective": model.objective, "arrays": arrays}
+    return shm, layout
+
+
+def attach_model(shm: SharedMemory, layout: dict) -> TreeModel:
+    """A model whose arrays are views of a shared memory segment"""
+    arrays = {
+        key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        for key, (offset, dtype, shape) in layout["arrays"].items()
+    }
+    nodes = arrays.pop("nodes")
+    return TreeModel(layout["num_features"], layout["objective"], nodes=nodes, **arrays)
+
+
+def worker_main(conn) -> None:
+    """Predicts the batches sent over `conn` until it receives None"""
+    attached = {}  # segment name -> (SharedMemory, TreeModel)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        segment, layout, live, X = message
+        # drop the models the server no longer uses, their memory is freed once no process maps it
+        for name in [name for name in attached if name not in live and name != segment]:
+            shm, model = attached.pop(name)
+            del model
+            shm.close()
+        try:
+            if segment not in attached:
+                shm = SharedMemory(name=segment)
+                attached[segment] = (shm, attach_model(shm, layout))
+            conn.send((True, attached[segment][1].predict(X)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+    while attached:
+        _, (shm, model) = attached.popitem()
+        del model
+        shm.close()
+
+
+class SharedModel:
+    """A model in shared memory, `predict` runs on a worker of the pool"""
+
+    def __init__(self, pool, shm: SharedMemory, layout: dict, num_trees: int) -> None:
+        self.pool = pool
+        self.shm = shm
+        self.segment = shm.name
+        self.layout = layout
+        self.num_features = layout["num_features"]
+        self.num_trees = num_trees
+        self.nbytes = shm.size
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.pool.predict(self, X)
+
+    def acquire(self) -> None:
+        """Keeps the segment until the matching `release`, taken when a batch gets the model"""
+        self.pool.acquire(self)
+
+    def release(self) -> None:
+        self.pool.release(self)
+
+    def retire(self) -> None:
+        """The model is no longer served, its segment goes once no batch holds it"""
+        self.pool.retire(self)
+
+
+class WorkerPool:
+    """
+    Worker processes started before the server accepts requests. `predict` blocks the calling
+    thread until a worker is idle and has predicted the batch; a worker that dies is replaced.
+    Segments of retired (replaced or evicted) models are unlinked once no batch holds them anymore.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self.num_workers = workers
+        # spawned, a fork would copy the server's threads and locks
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = queue.Queue()  # (process, connection)
+        self.workers = []
+        self.lock = threading.Lock()
+        self.segments = {}  # segment name -> SharedModel, live or retired but still held
+        self.inflight = collections.Counter()  # segment name -> batches holding it
+        self.retired = set()
+        self.batches = 0
+        self.restarts = 0
+
+    def start(self) -> None:
+        # workers share the server's resource tracker, one of their own would unlink the
+        # segments they attached to when they exit
+        resource_tracker.ensure_running()
+        for _ in range(self.num_workers):
+            self.idle.put(self.spawn())
+        logger.info(f"Started {self.num_workers} predictor workers")
+
+    def spawn(self) -> tuple:
+        conn, child = self.context.Pipe()
+        process = self.context.Process(target=worker_main, args=(child,), daemon=True)
+        process.start()
+        child.close()
+        self.workers.append(process)
+        return process, conn
+
+    def share(self, model: TreeModel) -> SharedModel:
+        shm, layout = share_model(model)
+        shared = SharedModel(self, shm, layout, model.num_trees)
+        with self.lock:
+            self.segments[shared.segment] = shared
+        return shared
+
+    def acquire(self, model: SharedModel) -> None:
+        with self.lock:
+            if model.segment not in self.segments:
+                raise ValueError(f"model segment {model.segment} was already unlinked")
+            self.inflight[model.segment] += 1
+
+    def release(self, model: SharedModel) -> None:
+        with self.lock:
+            self.inflight[model.segment] -= 1
+            self.unlink_unused()
+
+    def retire(self, model: SharedModel) -> None:
+        with self.lock:
+            self.retired.add(model.segment)
+            self.unlink_unused()
+
+    def unlink_unused(self) -> None:
+        for segment in [segment for segment in self.retired if self.inflight[segment] == 0]:
+            self.retired.discard(segment)
+            shared = self.segments.pop(segment)
+            shared.shm.close()
+            shared.shm.unlink()
+
+    def predict(self, model: SharedModel, X: np.ndarray) -> np.ndarray:
+        # held for the call as well, for callers that did not `acquire` the model themselves
+        self.acquire(model)
+        try:
+            ok, result = self.send(model, X)
+        finally:
+            self.release(model)
+        if not ok:
+            raise ValueError(result)
+        return result
+
+    def send(self, model: SharedModel, X: np.ndarray) -> tuple[bool, object]:
+        process, conn = self.idle.get()
+        with self.lock:
+            # segments still held by a batch stay attached in the workers that have them
+            live = list(self.segments)
+        try:
+            conn.send((model.segment, model.layout, live, X))
+            return conn.recv()
+        except (EOFError, OSError) as e:
+            logger.error(f"Predictor worker {process.pid} died: {e}")
+            conn.close()
+            self.workers.remove(process)
+            process, conn = self.spawn()
+            self.restarts += 1
+            raise RuntimeError(f"predictor worker died: {e}")
+        finally:
+            self.idle.put((process, conn))
+            with self.lock:
+                self.batches += 1
+
+    def close(self) -> None:
+        for _ in range(len(self.workers)):
+            process, conn = self.idle.get()
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+        with self.lock:
+            self.retired.update(self.segments)
+            self.inflight.clear()
+            self.unlink_unused()
+
+    def to_dict(self) -> dict:
+        workers = []
+        for process in self.workers:
+            workers.append({"pid": process.pid, "alive": process.is_alive(), **memory_of(process.pid)})
+        return {
+            "workers": workers,
+            "batches": self.batches,
+            "restarts": self.restarts,
+            "segments": len(self.segments),
+            "retired": len(self.retired),
+        }
+
+
+def memory_of(pid: int) -> dict:
+    """RSS and PSS (shared pages split between the processes mapping them) in bytes, on Linux"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as file:
+            for line in file:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    memory[key.lower()] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return memory